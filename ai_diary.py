@@ -4,14 +4,33 @@ import datetime
 from pathlib import Path
 from openai import OpenAI
 from dotenv import load_dotenv
+from diary_store import open_store_from_env
+from batch_summaries import deferred_enabled, enqueue_summary, new_job_id, PENDING_SUMMARY
+from request_layer import RequestLayer, DEFAULT_MEMO_TTL
+from languages import SessionLanguage
+from turn_store import TurnStore, QA_TRANSCRIPT
 
 load_dotenv()
 
+# Static prefix of every conversation request, kept identical so provider-side prompt caching applies
+COMPANION_PROMPT = "You are a compassionate diary companion. Ask thoughtful follow-up questions to help the user reflect on their day and express their feelings. Keep responses warm, supportive, and conversational. Ask only one follow-up question at a time."
+SUMMARY_PROMPT = """Create a personal diary entry summary in first-person narrative style. Include:
+                        1. Emotional highlights (how I felt)
+                        2. Key events (what happened)
+                        3. Write as if the user is personally writing their diary entry
+                        4. Keep it natural and reflective
+                        5. Use 'I' statements throughout
+                        
+                        Format as a cohesive diary entry paragraph, not bullet points."""
+
 class AIDiary:
     def __init__(self):
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.requests = RequestLayer(self.client)
         self.data_file = 'diary_entries.json'
+        self.store = open_store_from_env()  # Encrypted storage when DIARY_PASSPHRASE is set
         self.conversation_history = []
+        self.language = SessionLanguage()  # Guessed locally from the first answers unless DIARY_LANGUAGE is set
         
         # Diary conversation questions
         self.questions = [
@@ -34,21 +53,25 @@ class AIDiary:
         return []
     
     def save_diary_entry(self, entry):
+        if self.store is not None:
+            self.store.append("text_entry", entry["date"], entry)
+            return
+        
         diary_data = self.load_diary_data()
         diary_data.append(entry)
         
         with open(self.data_file, 'w', encoding='utf-8') as f:
             json.dump(diary_data, f, ensure_ascii=False, indent=2)
     
+    def question(self, index):
+        """Question `index` in the session language (English until it is known)"""
+        return self.language.localize(self.requests, self.questions)[index]
+    
     def get_ai_response(self, user_input, question):
         try:
-            response = self.client.chat.completions.create(
+            response, _ = self.requests.chat(dict(
                 model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a compassionate diary companion. Ask thoughtful follow-up questions to help the user reflect on their day and express their feelings. Keep responses warm, supportive, and conversational. Ask only one follow-up question at a time."
-                    },
+                messages=self.language.system_messages(COMPANION_PROMPT) + [
                     {
                         "role": "assistant", 
                         "content": question
@@ -60,35 +83,27 @@ class AIDiary:
                 ],
                 max_tokens=150,
                 temperature=0.7
-            )
+            ), memo_ttl=DEFAULT_MEMO_TTL)
             return response.choices[0].message.content.strip()
         except Exception as e:
             return f"Sorry, I'm having trouble connecting right now. Error: {str(e)}"
     
+    def summary_request(self, conversation_text):
+        return dict(
+            model="gpt-4o-mini",
+            messages=self.language.system_messages(SUMMARY_PROMPT) + [
+                {
+                    "role": "user",
+                    "content": f"Please summarize this conversation into a personal diary entry:\n\n{conversation_text}"
+                }
+            ],
+            max_tokens=300,
+            temperature=0.7
+        )
+    
     def create_diary_summary(self, conversation_text):
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Create a personal diary entry summary in first-person narrative style. Include:
-                        1. Emotional highlights (how I felt)
-                        2. Key events (what happened)
-                        3. Write as if the user is personally writing their diary entry
-                        4. Keep it natural and reflective
-                        5. Use 'I' statements throughout
-                        
-                        Format as a cohesive diary entry paragraph, not bullet points."""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Please summarize this conversation into a personal diary entry:\n\n{conversation_text}"
-                    }
-                ],
-                max_tokens=300,
-                temperature=0.7
-            )
+            response, _ = self.requests.chat(self.summary_request(conversation_text))
             return response.choices[0].message.content.strip()
         except Exception as e:
             return f"Could not create summary. Error: {str(e)}"
@@ -98,11 +113,11 @@ class AIDiary:
         print("I'm here to help you reflect on your day.")
         print("Type 'quit' anytime to finish and save your diary entry.\n")
         
-        conversation_text = ""
+        turns = TurnStore(store=self.store)
         question_index = 0
         
         # Start with first question
-        current_question = self.questions[question_index]
+        current_question = self.question(question_index)
         print(f"AI: {current_question}")
         
         while True:
@@ -115,8 +130,12 @@ class AIDiary:
                 print("AI: I'm listening... please share your thoughts.")
                 continue
             
+            self.language.observe_text(user_input)
+            
             # Add to conversation history
-            conversation_text += f"Q: {current_question}\nA: {user_input}\n\n"
+            now = datetime.datetime.now().isoformat()
+            turns.append({"speaker": "ai", "message": current_question, "timestamp": now})
+            turns.append({"speaker": "user", "message": user_input, "timestamp": now})
             
             # Get AI response (follow-up or next question)
             if question_index < len(self.questions) - 1:
@@ -127,7 +146,7 @@ class AIDiary:
                 # Move to next question after follow-up
                 question_index += 1
                 if question_index < len(self.questions):
-                    current_question = self.questions[question_index]
+                    current_question = self.question(question_index)
                     print(f"\nAI: {current_question}")
             else:
                 # Final response
@@ -136,12 +155,28 @@ class AIDiary:
                 print("\nAI: Thank you for sharing with me today. Let me create your diary entry...")
                 break
         
-        return conversation_text
+        return turns.transcript(QA_TRANSCRIPT)
     
     def run(self):
         conversation_text = self.start_conversation()
         
-        if conversation_text:
+        if conversation_text and deferred_enabled() and self.store is None:
+            # Save now, the summary is filled in by the next batch run
+            job_id = new_job_id()
+            self.save_diary_entry({
+                "date": datetime.datetime.now().isoformat(),
+                "conversation": conversation_text,
+                "diary_entry": PENDING_SUMMARY,
+                "summary_job": job_id,
+                "language": self.language.effective
+            })
+            enqueue_summary(job_id, self.summary_request(conversation_text), {
+                "type": "text_entry",
+                "path": os.path.abspath(self.data_file)
+            })
+            print("\n*** Diary saved. Your entry will be written by the next summary batch (python batch_summaries.py run) ***")
+        
+        elif conversation_text:
             print("\n*** Creating your diary entry...")
             
             # Create summary
@@ -151,7 +186,8 @@ class AIDiary:
             entry = {
                 "date": datetime.datetime.now().isoformat(),
                 "conversation": conversation_text,
-                "diary_entry": diary_summary
+                "diary_entry": diary_summary,
+                "language": self.language.effective
             }
             
             # Save entry
@@ -165,6 +201,8 @@ class AIDiary:
             print(diary_summary)
             print("="*50)
             print("*** Diary entry saved successfully! ***")
+            for line in self.requests.report():
+                print(line)
         else:
             print("No diary entry created. Come back anytime!")
 
@@ -0,0 +1,342 @@
+"""Content-addressed archive of recorded utterances.
+
+Each utterance is stored once, compressed, under the SHA-256 of its PCM
+samples, and conversation items link to it through an "audio" key. This
+keeps the audio around so transcripts can be re-run with a better model.
+
+    python audio_archive.py stats
+    python audio_archive.py prune
+    python audio_archive.py retranscribe [--data-dir .] [--model whisper-1] [--workers 4] [--since YYYY-MM-DD]
+
+Codecs: "flac" (lossless, default) and "opus" (lossy, much smaller) are
+encoded through pydub/ffmpeg. Without ffmpeg, audio falls back to gzip'd WAV.
+
+When an encrypted store is in use (DIARY_PASSPHRASE), every file is sealed
+with the store key and named by a keyed hash, so neither the audio nor a
+plain hash of it is on disk. Re-transcription only covers the plaintext day
+files: audio linked from store records is not re-transcribed.
+"""
+import io
+import os
+import re
+import gzip
+import json
+import time
+import wave
+import hashlib
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from dotenv import load_dotenv
+from diary_store import open_store_from_env, StoreError
+
+try:
+    from pydub import AudioSegment
+except ImportError:
+    AudioSegment = None
+
+load_dotenv()
+
+CODECS = {"flac": ("flac", {}), "opus": ("ogg", {"codec": "libopus", "bitrate": "24k"})}
+FALLBACK_SUFFIX = ".wav.gz"
+SEALED_SUFFIX = ".sealed"
+DAY_FILE = re.compile(r"^(simple_voice_diary|voice_diary)_(\d{4}-\d{2}-\d{2})\.json$")
+
+
+def _wav_bytes(samples, rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+    return buffer.getvalue()
+
+
+class AudioArchive:
+    def __init__(self, path, codec="flac", max_bytes=None, retention_days=None, store=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}'. Choose one of: {', '.join(CODECS)}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.codec = codec
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.store = store
+        self.index_file = self.path / "index.json"
+        self.index = {}
+        if self.index_file.exists():
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+    def _save_index(self):
+        tmp_path = self.index_file.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_file)
+
+    @property
+    def total_bytes(self):
+        return sum(item["bytes"] for item in self.index.values())
+
+    def _encode(self, samples, rate):
+        """Compress an utterance; returns (file suffix, encoded bytes)"""
+        if AudioSegment is not None:
+            fmt, options = CODECS[self.codec]
+            try:
+                segment = AudioSegment(data=np.asarray(samples, dtype=np.int16).tobytes(),
+                                       sample_width=2, frame_rate=rate, channels=1)
+                encoded = io.BytesIO()
+                segment.export(encoded, format=fmt, **options)
+                return f".{self.codec}", encoded.getvalue()
+            except Exception as e:
+                print(f"Archive Warning: {self.codec} encoding failed ({e}), storing gzip'd WAV")
+
+        return FALLBACK_SUFFIX, gzip.compress(_wav_bytes(samples, rate))
+
+    def add(self, samples, rate):
+        """Archive an utterance and return its content hash (deduplicated).
+
+        Returns None when the utterance alone is larger than max_bytes and so
+        can't be kept; the caller then has nothing to link to.
+        """
+        samples = np.asarray(samples, dtype=np.int16)
+        content = rate.to_bytes(4, "little") + samples.tobytes()
+        if self.store is not None:
+            digest = self.store.mac(content)
+        else:
+            digest = hashlib.sha256(content).hexdigest()
+
+        item = self.index.get(digest)
+        if item is not None and (self.path / item["file"]).exists():
+            item["last_used"] = time.time()
+            self._save_index()
+            return digest
+
+        folder = self.path / digest[:2]
+        folder.mkdir(exist_ok=True)
+        suffix, data = self._encode(samples, rate)
+        if self.store is not None:
+            suffix += SEALED_SUFFIX
+            data = self.store.seal_bytes(data, digest.encode("ascii"))
+        path = folder / (digest + suffix)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        now = time.time()
+        self.index[digest] = {
+            "file": str(path.relative_to(self.path)),
+            "bytes": path.stat().st_size,
+            "pcm_bytes": samples.nbytes,
+            "rate": rate,
+            "duration": round(len(samples) / rate, 2),
+            "created": now,
+            "last_used": now,
+        }
+        if self.max_bytes is not None and self.index[digest]["bytes"] > self.max_bytes:
+            self._evict(digest)
+            self._save_index()
+            return None
+        self.prune(keep=digest)
+        self._save_index()
+        return digest
+
+    def get_wav(self, digest):
+        """Return the archived utterance as WAV bytes, or None if evicted"""
+        item = self.index.get(digest)
+        if item is None:
+            return None
+        path = self.path / item["file"]
+        if not path.exists():
+            return None
+        name = item["file"]
+        with open(path, 'rb') as f:
+            data = f.read()
+        if name.endswith(SEALED_SUFFIX):
+            if self.store is None:
+                raise RuntimeError("Archived audio is encrypted; set DIARY_PASSPHRASE to read it")
+            data = self.store.open_bytes(data, digest.encode("ascii"))
+            name = name[:-len(SEALED_SUFFIX)]
+        if name.endswith(FALLBACK_SUFFIX):
+            return gzip.decompress(data)
+        if AudioSegment is None:
+            raise RuntimeError("Decoding archived audio requires pydub and ffmpeg")
+        fmt = CODECS[name.rsplit(".", 1)[1]][0]
+        segment = AudioSegment.from_file(io.BytesIO(data), format=fmt).set_channels(1).set_sample_width(2)
+        return _wav_bytes(np.frombuffer(segment.raw_data, dtype=np.int16), segment.frame_rate)
+
+    def _evict(self, digest):
+        item = self.index.pop(digest)
+        (self.path / item["file"]).unlink(missing_ok=True)
+
+    def prune(self, keep=None):
+        """Apply the retention policy, then evict least recently used until under max_bytes.
+
+        `keep` (the utterance just added) is never evicted.
+        """
+        evicted = 0
+        if self.retention_days is not None:
+            cutoff = time.time() - self.retention_days * 86400
+            for digest in [d for d, item in self.index.items() if item["created"] < cutoff and d != keep]:
+                self._evict(digest)
+                evicted += 1
+
+        if self.max_bytes is not None:
+            total = self.total_bytes
+            for digest in sorted(self.index, key=lambda d: self.index[d]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                if digest == keep:
+                    continue
+                total -= self.index[digest]["bytes"]
+                self._evict(digest)
+                evicted += 1
+
+        if evicted:
+            self._save_index()
+        return evicted
+
+
+def open_archive_from_env(store=None):
+    """Return the audio archive if AUDIO_ARCHIVE_DIR is set, otherwise None.
+
+    Pass the encrypted store (if any) so archived audio is sealed with its key.
+    """
+    path = os.getenv('AUDIO_ARCHIVE_DIR')
+    if not path:
+        return None
+    max_mb = os.getenv('AUDIO_ARCHIVE_MAX_MB')
+    retention = os.getenv('AUDIO_ARCHIVE_RETENTION_DAYS')
+    return AudioArchive(
+        path,
+        codec=os.getenv('AUDIO_ARCHIVE_CODEC', 'flac'),
+        max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+        retention_days=float(retention) if retention else None,
+        store=store
+    )
+
+
+def iter_archived_items(data_dir, since=None):
+    """Yield (day file, conversation index, item) for every item linked to audio.
+
+    Only the plaintext day files are read; entries in the encrypted store are skipped.
+    """
+    names = sorted(name for name in os.listdir(data_dir) if DAY_FILE.match(name))
+    for name in names:
+        if since and DAY_FILE.match(name).group(2) < since:
+            continue
+        path = Path(data_dir) / name
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for i, item in enumerate(data.get("conversation", [])):
+            if item.get("audio"):
+                yield path, i, item
+
+
+def retranscribe(archive, client, data_dir=".", model="whisper-1", workers=4, since=None, language=None):
+    """Re-run STT over archived audio with up to `workers` requests in flight.
+
+    Items are streamed from the day files, so only the in-flight utterances
+    are held in memory. Updated transcripts are written back per day file;
+    the previous text is kept as "original_message".
+    """
+    def transcribe(digest):
+        wav = archive.get_wav(digest)
+        if wav is None:
+            return None
+        options = {"language": language} if language else {}
+        response = client.audio.transcriptions.create(model=model, file=("utterance.wav", wav), **options)
+        return response.text.strip()
+
+    updates = {}  # day file -> {conversation index: text}
+    done, missing, failed = 0, 0, 0
+
+    def collect(finished):
+        nonlocal done, missing, failed
+        for future in finished:
+            path, i = pending.pop(future)
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f"STT Error ({path.name} #{i}): {str(e)}")
+                failed += 1
+                continue
+            if text is None:
+                missing += 1
+            else:
+                updates.setdefault(path, {})[i] = text
+                done += 1
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, i, item in iter_archived_items(data_dir, since):
+            if len(pending) >= workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending[pool.submit(transcribe, item["audio"])] = (path, i)
+        collect(wait(pending)[0])
+
+    for path, texts in updates.items():
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for i, text in texts.items():
+            item = data["conversation"][i]
+            item.setdefault("original_message", item["message"])
+            item["message"] = text
+            item["transcribed_with"] = model
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    return {"updated": done, "missing": missing, "failed": failed, "files": len(updates)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the archived utterance audio")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Show archive size and compression")
+    sub.add_parser("prune", help="Apply retention and size limits now")
+    rt = sub.add_parser("retranscribe", help="Re-run STT over archived audio")
+    rt.add_argument("--data-dir", default=".")
+    rt.add_argument("--model", default="whisper-1")
+    rt.add_argument("--workers", type=int, default=4)
+    rt.add_argument("--since", help="Only day files from this date (YYYY-MM-DD)")
+    rt.add_argument("--language", help="Force the STT language")
+    args = parser.parse_args(argv)
+
+    try:
+        store = open_store_from_env()
+    except StoreError as e:
+        print(f"Store Error: {e}")
+        return
+    archive = open_archive_from_env(store)
+    if archive is None:
+        print("Set AUDIO_ARCHIVE_DIR to enable the audio archive.")
+        return
+
+    if args.command == "stats":
+        pcm = sum(item["pcm_bytes"] for item in archive.index.values())
+        total = archive.total_bytes
+        seconds = sum(item["duration"] for item in archive.index.values())
+        print(f"Utterances: {len(archive.index)} ({seconds / 60:.1f} min)")
+        print(f"Stored: {total / 1e6:.2f} MB (raw PCM {pcm / 1e6:.2f} MB, {pcm / total if total else 0:.1f}x)")
+    elif args.command == "prune":
+        print(f"Evicted {archive.prune()} utterance(s).")
+    else:
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        start = time.perf_counter()
+        result = retranscribe(archive, client, args.data_dir, args.model, args.workers, args.since, args.language)
+        print(f"*** Re-transcribed {result['updated']} utterance(s) in {result['files']} file(s) "
+              f"({time.perf_counter() - start:.1f}s) ***")
+        if result["missing"] or result["failed"]:
+            print(f"Skipped: {result['missing']} evicted, {result['failed']} failed")
+        if store is not None:
+            print("Note: audio linked from encrypted store records is not re-transcribed.")
+
+
+if __name__ == "__main__":
+    main()
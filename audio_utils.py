@@ -0,0 +1,165 @@
+import math
+from functools import lru_cache
+import numpy as np
+
+# Whisper works on 16 kHz mono, anything above that is wasted upload
+UPLOAD_RATE = 16000
+INT16_MAX = 32767
+
+
+class AudioBuffer:
+    """Int16 sample buffer made of fixed-size preallocated NumPy blocks.
+
+    A full block is never copied: appending past it just starts a new one,
+    so peak memory stays at the recording size plus one block.
+    """
+
+    def __init__(self, rate, block_seconds=10):
+        self.rate = rate
+        self.block_size = max(int(rate * block_seconds), 1)
+        self.clear()
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def capacity(self):
+        return len(self._blocks) * self.block_size
+
+    @property
+    def duration(self):
+        return self._length / self.rate
+
+    def append(self, data):
+        """Append a chunk of raw int16 PCM bytes (as returned by stream.read)"""
+        chunk = np.frombuffer(data, dtype=np.int16)
+        fill, n = self._fill, len(chunk)
+        if fill + n <= self.block_size:
+            self._blocks[-1][fill:fill + n] = chunk
+            self._fill += n
+            self._length += n
+            return
+        while len(chunk):
+            if self._fill == self.block_size:
+                self._blocks.append(np.empty(self.block_size, dtype=np.int16))
+                self._fill = 0
+            n = min(len(chunk), self.block_size - self._fill)
+            self._blocks[-1][self._fill:self._fill + n] = chunk[:n]
+            self._fill += n
+            self._length += n
+            chunk = chunk[n:]
+
+    def read(self, start, stop):
+        """Samples start..stop (within the recording) as one array"""
+        first, last = start // self.block_size, (stop - 1) // self.block_size
+        if first == last:
+            offset = first * self.block_size
+            return self._blocks[first][start - offset:stop - offset]
+        return np.concatenate([
+            self._blocks[b][max(start - b * self.block_size, 0):min(stop - b * self.block_size, self.block_size)]
+            for b in range(first, last + 1)
+        ])
+
+    def samples(self):
+        """The whole recording as one contiguous array (a copy once there are several blocks)"""
+        if not self._length:
+            return np.empty(0, dtype=np.int16)
+        return self.read(0, self._length)
+
+    def clear(self):
+        self._blocks = []
+        self._length = 0
+        self._fill = self.block_size  # Samples used in the last block; full means "allocate on next append"
+
+
+@lru_cache(maxsize=8)
+def _polyphase_filter(up, down, half_width=10, beta=5.0):
+    """Design a Kaiser-windowed low-pass filter split into `up` phases"""
+    max_rate = max(up, down)
+    cutoff = 1.0 / max_rate
+    half_len = half_width * max_rate
+    n = np.arange(-half_len, half_len + 1)
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(len(n), beta) * up
+
+    taps_per_phase = math.ceil(len(h) / up)
+    padded = np.zeros(taps_per_phase * up, dtype=np.float32)
+    padded[:len(h)] = h
+    # phases[p, k] == h[p + k * up]
+    phases = padded.reshape(taps_per_phase, up).T.copy()
+    phases.setflags(write=False)
+    return phases, half_len
+
+
+def _read_padded(samples, start, stop):
+    """samples[start:stop] with zeros for indices outside the recording"""
+    window = np.zeros(stop - start, dtype=np.int16)
+    lo, hi = max(start, 0), min(stop, len(samples))
+    if lo < hi:
+        window[lo - start:hi - start] = samples.read(lo, hi) if isinstance(samples, AudioBuffer) else samples[lo:hi]
+    return window
+
+
+def resample(samples, src_rate, dst_rate=UPLOAD_RATE, block_size=16384):
+    """Polyphase resample int16 samples (array or AudioBuffer) from src_rate to dst_rate.
+
+    Only the output samples are computed (no zero-stuffed intermediate
+    signal), and the work is done in blocks: each block reads just the input
+    window it needs, zero-filled at the edges, so the input is never copied
+    or padded as a whole.
+    """
+    if src_rate == dst_rate or len(samples) == 0:
+        if isinstance(samples, AudioBuffer):
+            samples = samples.samples()
+        return np.asarray(samples).astype(np.int16, copy=False)
+    if not isinstance(samples, AudioBuffer):
+        samples = np.asarray(samples)
+
+    g = math.gcd(src_rate, dst_rate)
+    up, down = dst_rate // g, src_rate // g
+    phases, half_len = _polyphase_filter(up, down)
+    taps = phases.shape[1]
+
+    n_out = math.ceil(len(samples) * up / down)
+    out = np.empty(n_out, dtype=np.int16)
+    k = np.arange(taps)
+
+    for start in range(0, n_out, block_size):
+        m = np.arange(start, min(start + block_size, n_out), dtype=np.int64)
+        j = m * down + half_len
+        phase = j % up
+        base = j // up
+        lo = int(base[0]) - taps + 1
+        window = _read_padded(samples, lo, int(base[-1]) + 1)
+        windows = window[base[:, None] - k[None, :] - lo].astype(np.float32)
+        block = np.einsum('ij,ij->i', windows, phases[phase])
+        np.clip(np.rint(block), -INT16_MAX - 1, INT16_MAX, out=block)
+        out[start:start + len(m)] = block
+
+    return out
+
+
+def peak_normalize(samples, target=0.9, max_gain=10.0):
+    """Scale samples so the loudest peak sits at `target` of full scale.
+
+    `max_gain` stops near-silent recordings from being blown up into noise.
+    """
+    samples = np.asarray(samples, dtype=np.int16)
+    if len(samples) == 0:
+        return samples
+    peak = int(np.max(np.abs(samples.astype(np.int32))))
+    if peak == 0:
+        return samples
+    gain = min(target * INT16_MAX / peak, max_gain)
+    if abs(gain - 1.0) < 0.01:
+        return samples
+    scaled = samples.astype(np.float32) * gain
+    np.clip(np.rint(scaled), -INT16_MAX - 1, INT16_MAX, out=scaled)
+    return scaled.astype(np.int16)
+
+
+def prepare_for_upload(samples, src_rate, dst_rate=UPLOAD_RATE, normalize=True):
+    """Resample (and optionally normalize) recorded audio (array or AudioBuffer) for STT upload"""
+    samples = resample(samples, src_rate, dst_rate)
+    if normalize:
+        samples = peak_normalize(samples)
+    return samples
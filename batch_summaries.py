@@ -0,0 +1,363 @@
+"""Deferred diary summaries through a batch-jobs interface.
+
+With DEFERRED_SUMMARIES=true, the apps save the session right away with a
+pending summary and queue the summary request here instead of making an
+interactive call. The queue is then sent in bulk (cheaper, higher
+throughput) and each result is written back into the entry it belongs to.
+
+    python batch_summaries.py submit  [--max-jobs N]
+    python batch_summaries.py collect
+    python batch_summaries.py run     [--poll 30]
+    python batch_summaries.py status
+
+A job whose batch failed as a whole, or that is missing from the batch
+output, goes back to the queue until it has been tried SUMMARY_MAX_ATTEMPTS
+times (default 3). A per-job error from the provider is final.
+
+Job store layout (SUMMARY_JOBS_DIR, default `summary_jobs/`):
+    queued/<job>.json     waiting to be submitted
+    submitted/<job>.json  part of a batch that hasn't finished
+    done/<job>.json       result written back (or failed), kept for metrics
+    batches/<batch>.json  backend name, provider batch id and its job ids
+"""
+import io
+import os
+import json
+import time
+import uuid
+import argparse
+import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PENDING_SUMMARY = "(Summary pending - it will be added once the batch finishes.)"
+STATES = ("queued", "submitted", "done")
+BATCH_FAILED = "*"  # poll() key for an error that applies to every job in the batch
+MISSING_RESULT = "missing from batch output"
+
+
+def deferred_enabled():
+    return os.getenv('DEFERRED_SUMMARIES', '').lower() in ('1', 'true', 'yes')
+
+
+def _jobs_dir():
+    return Path(os.getenv('SUMMARY_JOBS_DIR', 'summary_jobs'))
+
+
+def _max_attempts():
+    return int(os.getenv('SUMMARY_MAX_ATTEMPTS', 3))
+
+
+def _write_json(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def enqueue_summary(job_id, request, target):
+    """Queue a chat-completions request whose result is written to `target`.
+
+    `target` is {"type": "day_file", "path", "key"} for voice day files or
+    {"type": "text_entry", "path"} for diary_entries.json. The entry
+    itself carries "summary_job": job_id so a result is never written into
+    an entry that has since been replaced.
+    """
+    _write_json(_jobs_dir() / "queued" / f"{job_id}.json", {
+        "id": job_id,
+        "request": request,
+        "target": target,
+        "created": time.time(),
+    })
+    return job_id
+
+
+class LocalBatchBackend:
+    """Stand-in for the Batch API that completes every batch immediately.
+
+    For tests only: `complete(request) -> str` produces each result, so the
+    queue can be exercised without network access or cost. It is not offered
+    on the command line, since its results are written into real entries.
+    Results are kept in the job store until collected, like a real batch
+    output file.
+    """
+    name = "local"
+
+    def __init__(self, complete=None):
+        self.complete = complete
+
+    def submit(self, requests):
+        if self.complete is None:
+            raise ValueError("LocalBatchBackend needs a complete() function to submit")
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        results = {}
+        for custom_id, request in requests:
+            try:
+                results[custom_id] = (self.complete(request), None)
+            except Exception as e:
+                results[custom_id] = (None, str(e))
+        _write_json(_jobs_dir() / "local_results" / f"{batch_id}.json", results)
+        return batch_id
+
+    def poll(self, batch_id):
+        path = _jobs_dir() / "local_results" / f"{batch_id}.json"
+        if not path.exists():
+            return {BATCH_FAILED: (None, "local batch results are missing")}
+        results = {job_id: tuple(result) for job_id, result in _read_json(path).items()}
+        path.unlink()
+        return results
+
+
+class OpenAIBatchBackend:
+    """OpenAI Batch API (`/v1/chat/completions`, 24h completion window)"""
+    name = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, requests):
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": request},
+                       ensure_ascii=False)
+            for custom_id, request in requests
+        ]
+        batch_input = io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+        uploaded = self.client.files.create(file=("summaries.jsonl", batch_input), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        """Return {custom_id: (text, error)} once the batch is finished, else None"""
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                response = row.get("response") or {}
+                if response.get("status_code") == 200:
+                    text = response["body"]["choices"][0]["message"]["content"].strip()
+                    results[row["custom_id"]] = (text, None)
+                else:
+                    error = row.get("error") or response.get("body", {}).get("error")
+                    results[row["custom_id"]] = (None, json.dumps(error))
+        if not results and batch.status != "completed":
+            results = {BATCH_FAILED: (None, f"batch {batch.status}")}
+        return results
+
+
+def make_backend(name):
+    if name == "local":
+        return LocalBatchBackend()
+    from openai import OpenAI
+    return OpenAIBatchBackend(OpenAI(api_key=os.getenv('OPENAI_API_KEY')))
+
+
+def write_back(target, job_id, summary):
+    """Put a finished summary into its entry; False if the entry is gone"""
+    path = Path(target["path"])
+    if not path.exists():
+        return False
+    data = _read_json(path)
+
+    if target["type"] == "day_file":
+        entry = data
+    else:
+        entry = next((e for e in data if e.get("summary_job") == job_id), None)
+    if entry is None or entry.get("summary_job") != job_id:
+        return False
+
+    entry[target.get("key", "diary_entry")] = summary
+    del entry["summary_job"]
+    _write_json(path, data)
+    return True
+
+
+def submit(backend, max_jobs=None):
+    """Send queued jobs to the backend as one batch; returns the batch id or None"""
+    jobs_dir = _jobs_dir()
+    queued = sorted((jobs_dir / "queued").glob("*.json"), key=lambda p: p.stat().st_mtime)[:max_jobs]
+    if not queued:
+        return None
+
+    jobs = [_read_json(path) for path in queued]
+    batch_id = backend.submit([(job["id"], job["request"]) for job in jobs])
+    _write_json(jobs_dir / "batches" / f"{batch_id}.json", {
+        "id": batch_id,
+        "backend": backend.name,
+        "jobs": [job["id"] for job in jobs],
+        "submitted": time.time(),
+    })
+    for job, path in zip(jobs, queued):
+        job["batch"] = batch_id
+        job["submitted"] = time.time()
+        _write_json(jobs_dir / "submitted" / path.name, job)
+        path.unlink()
+    return batch_id
+
+
+def pending_batches():
+    batches_dir = _jobs_dir() / "batches"
+    if not batches_dir.exists():
+        return []
+    return [_read_json(path) for path in sorted(batches_dir.glob("*.json"))]
+
+
+def _requeue(job, error):
+    """Put a job lost with its batch back in the queue; False once it is out of attempts"""
+    job["attempts"] = job.get("attempts", 0) + 1
+    job["last_error"] = error
+    if job["attempts"] >= _max_attempts():
+        return False
+    job.pop("batch", None)
+    job.pop("submitted", None)
+    _write_json(_jobs_dir() / "queued" / f"{job['id']}.json", job)
+    return True
+
+
+def collect(backends=None):
+    """Poll unfinished batches and write results back; returns (written, failed).
+
+    Jobs that only failed along with their batch are requeued, not counted.
+    """
+    jobs_dir = _jobs_dir()
+    backends = dict(backends or {})
+    written = failed = 0
+    for batch in pending_batches():
+        batch_path = jobs_dir / "batches" / f"{batch['id']}.json"
+        if batch["backend"] not in backends:
+            backends[batch["backend"]] = make_backend(batch["backend"])
+        backend = backends[batch["backend"]]
+        results = backend.poll(batch["id"])
+        if results is None:
+            continue
+
+        for job_id in batch["jobs"]:
+            job_path = jobs_dir / "submitted" / f"{job_id}.json"
+            if not job_path.exists():
+                continue
+            job = _read_json(job_path)
+            if job_id in results:
+                text, error = results[job_id]
+            else:
+                text, error = results.get(BATCH_FAILED, (None, MISSING_RESULT))
+                if _requeue(job, error):
+                    print(f"Summary job {job_id[:8]} requeued ({error}, attempt {job['attempts']})")
+                    job_path.unlink()
+                    continue
+            if text is not None and not write_back(job["target"], job_id, text):
+                error = "entry no longer exists"
+            job["completed"] = time.time()
+            job["error"] = error
+            if error:
+                failed += 1
+                print(f"Summary job {job_id[:8]} failed: {error}")
+            else:
+                written += 1
+            _write_json(jobs_dir / "done" / f"{job_id}.json", job)
+            job_path.unlink()
+        batch_path.unlink()
+    return written, failed
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def queue_metrics():
+    """Queue depth, in-flight count and turnaround times (seconds)"""
+    jobs_dir = _jobs_dir()
+    counts = {state: len(list((jobs_dir / state).glob("*.json"))) if (jobs_dir / state).exists() else 0
+              for state in STATES}
+    metrics = {"queued": counts["queued"], "in_flight": counts["submitted"], "completed": counts["done"]}
+
+    if counts["queued"]:
+        oldest = min(_read_json(p)["created"] for p in (jobs_dir / "queued").glob("*.json"))
+        metrics["oldest_queued_age"] = time.time() - oldest
+
+    if counts["done"]:
+        done = [_read_json(p) for p in (jobs_dir / "done").glob("*.json")]
+        turnaround = [job["completed"] - job["created"] for job in done if not job.get("error")]
+        metrics["failed"] = sum(1 for job in done if job.get("error"))
+        if turnaround:
+            metrics["turnaround_p50"] = _percentile(turnaround, 0.5)
+            metrics["turnaround_p95"] = _percentile(turnaround, 0.95)
+            metrics["turnaround_max"] = max(turnaround)
+    return metrics
+
+
+def _format_duration(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deferred, batched diary summaries")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("submit", "run"):
+        p = sub.add_parser(name)
+        p.add_argument("--max-jobs", type=int, help="Jobs per batch (default: whole queue)")
+        if name == "run":
+            p.add_argument("--poll", type=float, default=30.0, help="Seconds between status checks")
+    sub.add_parser("collect")
+    sub.add_parser("status")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        metrics = queue_metrics()
+        print(f"Queued: {metrics['queued']}  In flight: {metrics['in_flight']}  "
+              f"Completed: {metrics['completed']} (failed: {metrics.get('failed', 0)})")
+        if "oldest_queued_age" in metrics:
+            print(f"Oldest queued job: {_format_duration(metrics['oldest_queued_age'])} ago")
+        if "turnaround_p50" in metrics:
+            print(f"Turnaround p50 {_format_duration(metrics['turnaround_p50'])}, "
+                  f"p95 {_format_duration(metrics['turnaround_p95'])}, "
+                  f"max {_format_duration(metrics['turnaround_max'])}")
+        return
+
+    if args.command == "collect":
+        written, failed = collect()
+        print(f"*** Wrote {written} summaries ({failed} failed) ***")
+        return
+
+    backend = make_backend("openai")
+    batch_id = submit(backend, args.max_jobs)
+    if batch_id is None:
+        print("No queued summary jobs.")
+    else:
+        print(f"*** Submitted batch {batch_id} ***")
+
+    if args.command == "run":
+        while True:
+            written, failed = collect({backend.name: backend})
+            if written or failed:
+                print(f"*** Wrote {written} summaries ({failed} failed) ***")
+            if not any(batch["backend"] == backend.name for batch in pending_batches()):
+                break
+            time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    main()
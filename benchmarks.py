@@ -0,0 +1,354 @@
+"""Micro-benchmarks for the diary pipeline.
+
+Run all of them with `python benchmarks.py`, or pick some by name:
+`python benchmarks.py resample normalize`.
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+import numpy as np
+from audio_utils import AudioBuffer, resample, peak_normalize, prepare_for_upload
+from diary_store import EncryptedDiaryStore
+from diary_export import export
+from turn_log import TurnLog, read_log
+from duplex_audio import frame_rms, InterruptiblePlayer
+from languages import SessionLanguage, detect_text_language
+from turn_store import TurnStore, VOICE_TRANSCRIPT
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RECORD_RATE = 44100
+CHUNK = 1024
+EXPORT_FILE_HEADROOM = 32  # Files an export may hold open (the books of MAX_OPEN_MONTHS + 1 months, plus sources)
+BENCHMARKS = {}
+
+# One diary-style utterance per supported language
+LANGUAGE_FIXTURES = {
+    "en": "I had a long day at work but the evening walk with my sister was really nice.",
+    "ko": "오늘은 회사에서 정말 바빴지만 저녁에 친구랑 산책해서 기분이 좋아졌어요.",
+    "ja": "今日は仕事がとても忙しかったけど、夜に友達と散歩して気分が良くなりました。",
+    "zh": "今天工作很忙，但是晚上和朋友散步，心情好多了。",
+    "es": "Hoy fue un día muy largo en el trabajo, pero la cena con mi familia fue muy bonita.",
+    "fr": "Aujourd'hui la journée était longue mais je suis content de la promenade avec ma sœur.",
+    "de": "Heute war ein langer Tag bei der Arbeit, aber der Abend mit meiner Schwester war sehr schön.",
+    "pt": "Hoje foi um dia muito longo no trabalho, mas o jantar com a minha família foi muito bom.",
+    "it": "Oggi è stata una giornata molto lunga al lavoro, ma la cena con la mia famiglia è stata bella.",
+    "ru": "Сегодня был длинный день на работе, но вечерняя прогулка с сестрой была чудесной.",
+    "ar": "كان اليوم طويلا في العمل لكن المشي مع أختي في المساء كان جميلا.",
+    "hi": "आज काम पर बहुत लंबा दिन था लेकिन शाम को बहन के साथ टहलना अच्छा लगा।",
+}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__.replace("bench_", "")] = func
+    return func
+
+
+def measure(func, repeat=3):
+    """Return (best wall time in seconds, peak traced memory in bytes)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def synthetic_speech(seconds, rate=RECORD_RATE, seed=0):
+    """Voice-band tones plus noise, as int16 samples"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    signal = sum(np.sin(2 * np.pi * f * t) * a for f, a in [(180, 3000), (720, 1500), (2400, 600)])
+    signal = signal * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t)) + rng.normal(0, 200, len(t))
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+
+@contextlib.contextmanager
+def open_file_limit(headroom):
+    """Allow only `headroom` more open files than are open now (no-op without `resource`)"""
+    if resource is None or not os.path.isdir("/proc/self/fd"):
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (len(os.listdir("/proc/self/fd")) + headroom, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+def report(name, seconds, peak_bytes, extra=""):
+    print(f"{name:<40} {seconds * 1000:9.2f} ms  {peak_bytes / 1024 / 1024:8.2f} MB peak  {extra}")
+
+
+@benchmark
+def bench_buffer():
+    """Chunk accumulation: list of bytes + join vs block-based AudioBuffer"""
+    for minutes in (1, 10):
+        source = synthetic_speech(minutes * 60)
+
+        def stream_reads():
+            # Like stream.read(), every chunk is a fresh bytes object
+            for start in range(0, len(source), CHUNK):
+                yield source[start:start + CHUNK].tobytes()
+
+        def with_list():
+            frames = []
+            for chunk in stream_reads():
+                frames.append(chunk)
+            return b''.join(frames)
+
+        def with_buffer():
+            frames = AudioBuffer(RECORD_RATE)
+            for chunk in stream_reads():
+                frames.append(chunk)
+            return frames
+
+        report(f"list + join ({minutes} min)", *measure(with_list))
+        report(f"AudioBuffer ({minutes} min)", *measure(with_buffer))
+        report(f"list + join + resample ({minutes} min)",
+               *measure(lambda: resample(np.frombuffer(with_list(), dtype=np.int16), RECORD_RATE), repeat=1))
+        report(f"AudioBuffer + resample ({minutes} min)",
+               *measure(lambda: resample(with_buffer(), RECORD_RATE), repeat=1))
+
+
+@benchmark
+def bench_resample():
+    """Polyphase resample 44.1 kHz -> 16 kHz"""
+    for seconds in (10, 60, 600):
+        samples = synthetic_speech(seconds)
+        elapsed, peak = measure(lambda: resample(samples, RECORD_RATE))
+        report(f"resample {seconds}s", elapsed, peak, f"{seconds / elapsed:7.0f}x realtime")
+
+
+@benchmark
+def bench_normalize():
+    """Peak normalization at the upload rate"""
+    for seconds in (10, 60, 600):
+        samples = (synthetic_speech(seconds, rate=16000) // 4).astype(np.int16)
+        report(f"peak_normalize {seconds}s", *measure(lambda: peak_normalize(samples)))
+
+
+@benchmark
+def bench_upload_size():
+    """Bytes sent to Whisper per minute of speech, before and after"""
+    samples = synthetic_speech(60)
+    before = samples.nbytes
+    elapsed, peak = measure(lambda: prepare_for_upload(samples, RECORD_RATE))
+    after = prepare_for_upload(samples, RECORD_RATE).nbytes
+    report("prepare_for_upload 60s", elapsed, peak,
+           f"{before / 1e6:.2f} MB -> {after / 1e6:.2f} MB ({before / after:.2f}x smaller)")
+
+
+@benchmark
+def bench_store():
+    """Encrypted store: per-record append cost and streaming read memory"""
+    entry = {"conversation": "Q: How are you?\nA: " + "Pretty good, long day at work. " * 40, "diary_entry": "Today I " * 60}
+    with tempfile.TemporaryDirectory() as path:
+        store = EncryptedDiaryStore(path, "benchmark passphrase")
+        for total in (1000, 5000):
+            batch = total - len(store)
+            start = time.perf_counter()
+            for _ in range(batch):
+                store.append("text_entry", "2025-08-01", entry)
+            per_append = (time.perf_counter() - start) / batch
+            report(f"append at {total} records", per_append, 0, "(per record, incl. fsync)")
+
+        elapsed, peak = measure(lambda: sum(1 for _ in store.iter_records()), repeat=1)
+        report(f"stream-decrypt {len(store)} records", elapsed, peak)
+        elapsed, peak = measure(lambda: store.get(len(store) // 2), repeat=1)
+        report("random access get()", elapsed, peak)
+
+
+@benchmark
+def bench_export():
+    """Full and incremental export; checks that peak memory and open files stay flat"""
+    peaks = {}
+    for years in (1, 4, 16):
+        with tempfile.TemporaryDirectory() as data_dir:
+            with open(os.path.join(data_dir, "diary_entries.json"), 'w', encoding='utf-8') as f:
+                f.write("[")
+                # Date order, then a few late entries that send three early months to the reordered pass
+                dates = [datetime.date(2010, 1, 1) + datetime.timedelta(days=day) for day in range(365 * years)]
+                dates += [datetime.date(2010, month, 15) for month in (1, 2, 3)]
+                for i, date in enumerate(dates):
+                    entry = {"date": f"{date}T21:00:00", "conversation": "Q: How was today?\nA: " + "Busy but fine. " * 50,
+                             "diary_entry": "Today I " * 80}
+                    f.write(("," if i else "") + json.dumps(entry))
+                f.write("]")
+
+            full = lambda: export(data_dir, tempfile.mkdtemp(dir=data_dir), with_conversation=True)
+            elapsed, peak = measure(full, repeat=1)
+            report(f"full export ({years}y, {len(dates)} entries)", elapsed, peak)
+            peaks[years] = peak
+            with open_file_limit(EXPORT_FILE_HEADROOM):
+                full()  # Raises "Too many open files" if months pile up
+
+            out_dir = os.path.join(data_dir, "exports")
+            export(data_dir, out_dir, with_conversation=True)
+            elapsed, peak = measure(lambda: export(data_dir, out_dir, with_conversation=True), repeat=1)
+            report(f"no-change export ({years}y)", elapsed, peak)
+    assert peaks[16] < 1.5 * peaks[1], "export peak memory grows with the archive"
+
+
+@benchmark
+def bench_turn_log():
+    """Write-ahead turn log: append latency seen by the conversation loop"""
+    messages = list(LANGUAGE_FIXTURES.values())
+    items = [{"speaker": "user", "message": messages[i % len(messages)] * 2,
+              "timestamp": "2025-08-01T21:00:00", "emotion": {"dominant": "content", "intensity": 0.6}}
+             for i in range(len(messages))]
+    turns = 200
+    with tempfile.TemporaryDirectory() as path:
+        log_path = os.path.join(path, "fsync_each.wal")
+
+        def fsync_each():
+            with open(log_path, 'a', encoding='utf-8') as f:
+                for i in range(turns):
+                    f.write(json.dumps({"type": "item", "item": items[i % len(items)]}, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        elapsed, _ = measure(fsync_each, repeat=1)
+        report("fsync per append", elapsed / turns, 0, "(per append)")
+
+        log = TurnLog(os.path.join(path, "group.wal"))
+        start = time.perf_counter()
+        for i in range(turns):
+            log.append_item(items[i % len(items)])
+        elapsed = time.perf_counter() - start
+        log.close()
+        report("buffered append + group fsync", elapsed / turns, 0, "(per append)")
+        assert len(read_log(log.path)[1]) == turns
+
+
+@benchmark
+def bench_barge_in():
+    """Full duplex: VAD cost per mic chunk and cancel-to-listen latency"""
+    source = synthetic_speech(60)
+    chunks = [source[start:start + CHUNK].tobytes() for start in range(0, len(source) - CHUNK, CHUNK)]
+
+    def vad():
+        for chunk in chunks:
+            frame_rms(chunk)
+
+    elapsed, peak = measure(vad)
+    report("energy VAD per chunk", elapsed / len(chunks), peak, f"({CHUNK / RECORD_RATE * 1000:.1f} ms of audio)")
+
+    # A long-running "player" stands in for mpg123/afplay. Same path as the app:
+    # cancel + stop(wait=False) on barge-in, latency taken once the process exited
+    latencies = []
+    for _ in range(10):
+        stopped = []
+        player = InterruptiblePlayer(command=["sleep"], on_interrupted=stopped.append)
+        cancel = threading.Event()
+        playing = threading.Thread(target=player.play, args=("30", cancel))
+        playing.start()
+        while player._process is None:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        start = time.perf_counter()
+        cancel.set()
+        player.stop(wait=False)
+        playing.join()
+        latencies.append(stopped[0] - start)
+    latencies.sort()
+    report("cancel-to-listen (stop playback)", latencies[len(latencies) // 2], 0, f"(max {latencies[-1] * 1000:.2f} ms)")
+
+
+@benchmark
+def bench_language():
+    """Session language: local detector accuracy/cost and per-turn overhead once cached"""
+    correct = sum(detect_text_language(text) == code for code, text in LANGUAGE_FIXTURES.items())
+    texts = list(LANGUAGE_FIXTURES.values())
+    elapsed, peak = measure(lambda: [detect_text_language(text) for text in texts])
+    report(f"local detect ({len(texts)} languages)", elapsed / len(texts), peak,
+           f"(per utterance, {correct}/{len(texts)} correct)")
+
+    for code, text in LANGUAGE_FIXTURES.items():
+        guess = detect_text_language(text)
+        if guess != code:
+            print(f"  {code}: detected as {guess}")
+
+    language = SessionLanguage("ko")
+    elapsed, peak = measure(lambda: [(language.transcription_options(), language.system_messages("prompt"),
+                                      language.voice) for _ in range(1000)])
+    report("cached language per turn", elapsed / 1000, peak, "(STT options + prompt + voice)")
+
+
+def retained(build):
+    """Return (result, bytes still allocated by it after building)"""
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+@benchmark
+def bench_turn_store():
+    """Per-session memory of conversation turns and transcript building"""
+    messages = list(LANGUAGE_FIXTURES.values())
+    emotions = ["calm", "happy", "tired", "anxious"]
+
+    def session_items(turns):
+        start = datetime.datetime(2025, 8, 1, 20, 0)
+        for i in range(turns):
+            timestamp = (start + datetime.timedelta(seconds=i * 7.5, microseconds=i * 13)).isoformat()
+            if i % 2 == 0:
+                yield {"speaker": "user", "message": messages[i % len(messages)], "timestamp": timestamp,
+                       "emotion": {"dominant": emotions[i % len(emotions)], "intensity": 0.6}}
+            else:
+                yield {"speaker": "ai", "message": "That sounds like a lot. How did it make you feel?",
+                       "timestamp": timestamp}
+
+    for turns in (1000, 20000):
+        as_list, list_bytes = retained(lambda: list(session_items(turns)))
+        in_memory, store_bytes = retained(lambda: TurnStore(session_items(turns), spill_bytes=1 << 40))
+        spilled, spill_bytes = retained(lambda: TurnStore(session_items(turns), spill_bytes=256 * 1024))
+        report(f"list of dicts ({turns} turns)", *measure(lambda: list(session_items(turns)), repeat=1),
+               f"{list_bytes / 1024 / 1024:.2f} MB per session")
+        report(f"TurnStore in memory ({turns} turns)", *measure(lambda: TurnStore(session_items(turns), spill_bytes=1 << 40), repeat=1),
+               f"{store_bytes / 1024 / 1024:.2f} MB per session ({list_bytes / store_bytes:.1f}x smaller)")
+        report(f"TurnStore, 256 KB spill ({turns} turns)", *measure(lambda: TurnStore(session_items(turns), spill_bytes=256 * 1024), repeat=1),
+               f"{spill_bytes / 1024 / 1024:.2f} MB per session, {spilled.spilled_bytes / 1024 / 1024:.2f} MB on disk")
+
+        def concatenate():
+            text = ""
+            for item in as_list:
+                speaker = "I said" if item["speaker"] == "user" else "The AI asked"
+                text += f"{speaker}: {item['message']}\n"
+            return text
+
+        report(f"transcript by += ({turns} turns)", *measure(concatenate))
+        report(f"TurnStore.transcript, spilled ({turns} turns)", *measure(lambda: spilled.transcript(VOICE_TRANSCRIPT)))
+        assert spilled.transcript(VOICE_TRANSCRIPT) == concatenate()
+        assert list(in_memory) == as_list
+        spilled.close()
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            continue
+        print(f"\n=== {name}: {BENCHMARKS[name].__doc__} ===")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
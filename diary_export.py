@@ -0,0 +1,410 @@
+"""Export the whole diary archive to per-month Markdown / HTML books.
+
+    python diary_export.py [--data-dir .] [--out exports] [--format md html] [--with-conversation]
+
+Entries are streamed from `diary_entries.json`, every `voice_diary_*.json` /
+`simple_voice_diary_*.json` day file and the encrypted store (when
+DIARY_PASSPHRASE is set). Each source is already in date order, so they are
+merged lazily into one chronological stream and no source is ever loaded
+whole. A first pass fingerprints every month; only months whose fingerprint
+changed since the last export are rendered again (pass two), written chunk
+by chunk straight to disk with one month open at a time. A month that shows
+up again after the stream moved past it (e.g. a hand-edited, unsorted
+diary_entries.json) is flagged in pass one and rendered in an extra pass,
+at most MAX_OPEN_MONTHS such months per pass.
+
+HTML output includes print styles, so "Print to PDF" from a browser gives a
+PDF book without an extra dependency.
+"""
+import os
+import re
+import json
+import heapq
+import hashlib
+import argparse
+import calendar
+from html import escape
+from pathlib import Path
+from diary_store import open_store_from_env, StoreError
+
+EXPORT_VERSION = 1  # Bump to force every month to re-render
+MANIFEST = ".manifest.json"
+MAX_OPEN_MONTHS = 8  # Out-of-order months kept open together in one extra pass
+DAY_FILE = re.compile(r"^(simple_voice_diary|voice_diary)_(\d{4}-\d{2}-\d{2})\.json$")
+SOURCES = {"text_entry": "text", "voice_session": "voice", "simple_voice_session": "simple_voice"}
+
+
+def iter_json_array(path, chunk_size=64 * 1024):
+    """Yield the items of a top-level JSON array without loading the file"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer:
+            return
+        if buffer[0] != '[':
+            raise ValueError(f"{path} is not a JSON array")
+        pos, eof = 1, False
+
+        while True:
+            # Skip separators between items
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+            if pos >= len(buffer) or buffer[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+
+            yield item
+            pos = end
+            if pos > chunk_size:
+                buffer, pos = buffer[pos:], 0
+
+
+def _dominant_emotion(conversation):
+    counts, total, n = {}, 0.0, 0
+    for item in conversation:
+        emotion = item.get("emotion") if isinstance(item, dict) else None
+        if emotion:
+            counts[emotion["dominant"]] = counts.get(emotion["dominant"], 0) + 1
+            total += emotion["intensity"]
+            n += 1
+    if not counts:
+        return None
+    return {"dominant": max(counts.items(), key=lambda x: x[1])[0], "intensity": round(total / n, 2)}
+
+
+def normalize(source, raw):
+    """Map any stored entry shape onto one export record"""
+    date = raw.get("date", "")
+    if source == "text":
+        summary, emotion = raw.get("diary_entry", ""), None
+    elif source == "voice":
+        summary, emotion = raw.get("summary", ""), raw.get("emotion_analysis")
+    else:
+        summary, emotion = raw.get("diary_entry", ""), _dominant_emotion(raw.get("conversation", []))
+    return {
+        "date": date,
+        "day": date[:10],
+        "month": date[:7],
+        "source": source,
+        "summary": summary,
+        "emotion": emotion,
+        "conversation": raw.get("conversation", ""),
+        "fingerprint": hashlib.sha256(json.dumps(raw, sort_keys=True, ensure_ascii=False).encode("utf-8")).digest(),
+    }
+
+
+def iter_text_entries(data_dir):
+    path = Path(data_dir) / "diary_entries.json"
+    if path.exists():
+        for raw in iter_json_array(path):
+            yield normalize("text", raw)
+
+
+def iter_day_files(data_dir, prefix):
+    source = "voice" if prefix == "voice_diary" else "simple_voice"
+    names = sorted(
+        name for name in os.listdir(data_dir)
+        if (m := DAY_FILE.match(name)) and m.group(1) == prefix
+    )
+    for name in names:
+        with open(Path(data_dir) / name, 'r', encoding='utf-8') as f:
+            yield normalize(source, json.load(f))
+
+
+def iter_store_entries(store):
+    for record in store.iter_records(by_day=True):
+        if record["kind"] in SOURCES:
+            yield normalize(SOURCES[record["kind"]], {**record["data"], "date": record["data"].get("date", record["date"])})
+
+
+def iter_archive(data_dir, store=None):
+    """All entries from every source, merged into one chronological stream.
+
+    The merge relies on each source being in date order; the store is read
+    by day for that reason. Consumers still must not assume that a month
+    never reappears once the stream has moved past it.
+    """
+    streams = [
+        iter_text_entries(data_dir),
+        iter_day_files(data_dir, "voice_diary"),
+        iter_day_files(data_dir, "simple_voice_diary"),
+    ]
+    if store is not None:
+        streams.append(iter_store_entries(store))
+    return heapq.merge(*streams, key=lambda entry: entry["date"])
+
+
+def scan_months(entries):
+    """Pass one: per-month fingerprint and emotion stats (no text is kept).
+
+    A month whose entries are not contiguous in the stream is marked "reordered".
+    """
+    months = {}
+    previous = None
+    for entry in entries:
+        month = months.get(entry["month"])
+        if month is None:
+            month = months[entry["month"]] = {
+                "hash": hashlib.sha256(str(EXPORT_VERSION).encode()),
+                "entries": 0,
+                "emotions": {},
+                "days": {},
+                "reordered": False,
+            }
+        elif entry["month"] != previous:
+            month["reordered"] = True
+        previous = entry["month"]
+        month["hash"].update(entry["fingerprint"])
+        month["entries"] += 1
+        if entry["emotion"]:
+            dominant = entry["emotion"]["dominant"]
+            month["emotions"][dominant] = month["emotions"].get(dominant, 0) + 1
+            day = month["days"].setdefault(entry["day"], [0.0, 0])
+            day[0] += entry["emotion"]["intensity"]
+            day[1] += 1
+
+    for month in months.values():
+        month["hash"] = month["hash"].hexdigest()
+    return months
+
+
+def _month_title(month):
+    year, number = month.split("-")
+    return f"{calendar.month_name[int(number)]} {year}"
+
+
+def _conversation_lines(conversation):
+    if isinstance(conversation, str):
+        return [line for line in conversation.splitlines() if line.strip()]
+    return [f"{'Me' if item.get('speaker') == 'user' else 'AI'}: {item.get('message', '')}" for item in conversation]
+
+
+class MarkdownRenderer:
+    extension = "md"
+
+    def header(self, month, stats):
+        yield f"# Diary - {_month_title(month)}\n\n"
+        yield f"{stats['entries']} entries\n\n"
+        if stats["emotions"]:
+            yield "## Emotions\n\n```\n"
+            top = max(stats["emotions"].values())
+            for emotion, count in sorted(stats["emotions"].items(), key=lambda x: -x[1]):
+                yield f"{emotion:<14} {'#' * max(1, round(20 * count / top)):<20} {count}\n"
+            yield "```\n\n**Daily intensity**\n\n```\n"
+            for day, (total, n) in sorted(stats["days"].items()):
+                yield f"{day[8:]}  {'=' * round(20 * total / n):<20} {total / n:.2f}\n"
+            yield "```\n\n"
+
+    def entry(self, entry, with_conversation):
+        yield f"## {entry['day']} ({entry['source'].replace('_', ' ')})\n\n"
+        if entry["emotion"]:
+            yield f"*Mood: {entry['emotion']['dominant']} ({entry['emotion']['intensity']})*\n\n"
+        yield f"{entry['summary']}\n\n"
+        if with_conversation:
+            for line in _conversation_lines(entry["conversation"]):
+                yield f"> {line}\n"
+            yield "\n"
+
+    def footer(self, month):
+        return iter(())
+
+    def index(self, months):
+        yield "# Diary Export\n\n"
+        for month in sorted(months, reverse=True):
+            yield f"- [{_month_title(month)}]({month}.md) - {months[month]['entries']} entries\n"
+
+
+class HtmlRenderer:
+    extension = "html"
+    STYLE = """body{font-family:Georgia,serif;max-width:46em;margin:2em auto;padding:0 1em;color:#222}
+h1{border-bottom:2px solid #888}h2{margin-top:2em;font-size:1.2em}.mood{color:#666;font-style:italic}
+details{color:#555;font-size:.9em}svg text{font:11px sans-serif}
+@media print{body{margin:0}h2{page-break-after:avoid}.entry{page-break-inside:avoid}}"""
+
+    def header(self, month, stats):
+        title = escape(_month_title(month))
+        yield f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Diary - {title}</title>"
+        yield f"<style>{self.STYLE}</style></head><body>\n<h1>Diary - {title}</h1>\n"
+        yield f"<p>{stats['entries']} entries</p>\n"
+        if stats["emotions"]:
+            yield from self._bar_chart(sorted(stats["emotions"].items(), key=lambda x: -x[1]))
+            yield from self._intensity_chart(sorted(stats["days"].items()))
+
+    def _bar_chart(self, counts):
+        top = max(count for _, count in counts)
+        height = 18 * len(counts) + 4
+        yield f"<svg width=\"420\" height=\"{height}\" role=\"img\" aria-label=\"Emotion counts\">"
+        for i, (emotion, count) in enumerate(counts):
+            width = round(280 * count / top)
+            yield (f"<text x=\"0\" y=\"{18 * i + 14}\">{escape(emotion)}</text>"
+                   f"<rect x=\"100\" y=\"{18 * i + 3}\" width=\"{width}\" height=\"14\" fill=\"#7a9cc6\"/>"
+                   f"<text x=\"{106 + width}\" y=\"{18 * i + 14}\">{count}</text>")
+        yield "</svg>\n"
+
+    def _intensity_chart(self, days):
+        yield "<svg width=\"420\" height=\"120\" role=\"img\" aria-label=\"Daily emotional intensity\">"
+        for day, (total, n) in days:
+            x = 10 + (int(day[8:]) - 1) * 13
+            h = round(90 * total / n)
+            yield f"<rect x=\"{x}\" y=\"{100 - h}\" width=\"10\" height=\"{h}\" fill=\"#c67a7a\"><title>{day}: {total / n:.2f}</title></rect>"
+        yield "<text x=\"10\" y=\"115\">1</text><text x=\"400\" y=\"115\">31</text></svg>\n"
+
+    def entry(self, entry, with_conversation):
+        yield f"<div class=\"entry\"><h2>{escape(entry['day'])} ({escape(entry['source'].replace('_', ' '))})</h2>\n"
+        if entry["emotion"]:
+            yield f"<p class=\"mood\">Mood: {escape(str(entry['emotion']['dominant']))} ({entry['emotion']['intensity']})</p>\n"
+        yield f"<p>{escape(entry['summary'])}</p>\n"
+        if with_conversation:
+            yield "<details><summary>Conversation</summary>\n"
+            for line in _conversation_lines(entry["conversation"]):
+                yield f"<p>{escape(line)}</p>\n"
+            yield "</details>\n"
+        yield "</div>\n"
+
+    def footer(self, month):
+        yield "</body></html>\n"
+
+    def index(self, months):
+        yield f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Diary Export</title><style>{self.STYLE}</style></head><body>\n"
+        yield "<h1>Diary Export</h1>\n<ul>\n"
+        for month in sorted(months, reverse=True):
+            yield f"<li><a href=\"{month}.html\">{escape(_month_title(month))}</a> - {months[month]['entries']} entries</li>\n"
+        yield "</ul></body></html>\n"
+
+
+RENDERERS = {"md": MarkdownRenderer, "html": HtmlRenderer}
+
+
+def write_chunks(path, chunks):
+    """Write rendered chunks to a temp file, then swap it into place"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+def export(data_dir=".", out_dir="exports", formats=("md", "html"), with_conversation=False, store=None):
+    """Export the archive, re-rendering only changed months. Returns the rebuilt months."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / MANIFEST
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    months = scan_months(iter_archive(data_dir, store))
+    renderers = [RENDERERS[fmt]() for fmt in formats]
+    # Output depends on the options too, not only on the entries
+    option_prefix = "conversation:" if with_conversation else "summary:"
+
+    stale = set()
+    for month, stats in months.items():
+        for renderer in renderers:
+            path = out_dir / f"{month}.{renderer.extension}"
+            if manifest.get(renderer.extension, {}).get(month) != option_prefix + stats["hash"] or not path.exists():
+                stale.add(month)
+
+    # Pass two: stream again, rendering only the stale months. An in-order
+    # month is finished as soon as the next rendered month starts; reordered
+    # months stay open until the end of their pass.
+    def open_month(month):
+        files = []
+        for renderer in renderers:
+            final_path = out_dir / f"{month}.{renderer.extension}"
+            tmp_path = final_path.with_suffix(final_path.suffix + ".tmp")
+            f = open(tmp_path, 'w', encoding='utf-8')
+            files.append((renderer, f, tmp_path, final_path))
+            for chunk in renderer.header(month, months[month]):
+                f.write(chunk)
+        return files
+
+    def finish_month(month, files):
+        for renderer, f, tmp_path, final_path in files:
+            for chunk in renderer.footer(month):
+                f.write(chunk)
+            f.close()
+            os.replace(tmp_path, final_path)
+
+    def render(selected):
+        outputs = {}  # month -> [(renderer, file, tmp path, final path)]
+        try:
+            for entry in iter_archive(data_dir, store):
+                month = entry["month"]
+                if month not in selected:
+                    continue
+                if month not in outputs:
+                    for done in [m for m in outputs if not months[m]["reordered"]]:
+                        finish_month(done, outputs.pop(done))
+                    outputs[month] = open_month(month)
+                for renderer, f, _, _ in outputs[month]:
+                    for chunk in renderer.entry(entry, with_conversation):
+                        f.write(chunk)
+            for month in list(outputs):
+                finish_month(month, outputs.pop(month))
+        finally:
+            for files in outputs.values():
+                for _, f, tmp_path, _ in files:
+                    f.close()
+                    tmp_path.unlink(missing_ok=True)
+
+    reordered = sorted(month for month in stale if months[month]["reordered"])
+    batches = [reordered[i:i + MAX_OPEN_MONTHS] for i in range(0, len(reordered), MAX_OPEN_MONTHS)] or [[]]
+    batches[0] += [month for month in stale if not months[month]["reordered"]]
+    for batch in batches:
+        if batch:
+            render(set(batch))
+
+    for renderer in renderers:
+        previous = manifest.get(renderer.extension, {})
+        for month in set(previous) - set(months):
+            (out_dir / f"{month}.{renderer.extension}").unlink(missing_ok=True)
+        manifest[renderer.extension] = {month: option_prefix + stats["hash"] for month, stats in months.items()}
+        write_chunks(out_dir / f"index.{renderer.extension}", renderer.index(months))
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    return sorted(stale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export diary entries to per-month Markdown/HTML books")
+    parser.add_argument("--data-dir", default=".", help="Directory with diary_entries.json and voice day files")
+    parser.add_argument("--out", default="exports", help="Output directory")
+    parser.add_argument("--format", nargs="+", choices=sorted(RENDERERS), default=["md", "html"])
+    parser.add_argument("--with-conversation", action="store_true", help="Include the full conversation")
+    args = parser.parse_args(argv)
+
+    try:
+        store = open_store_from_env()
+    except StoreError as e:
+        print(f"Store Error: {e}")
+        return
+
+    rebuilt = export(args.data_dir, args.out, args.format, args.with_conversation, store)
+    if rebuilt:
+        print(f"*** Rebuilt {len(rebuilt)} month(s): {', '.join(rebuilt)} ***")
+    else:
+        print("*** Export is up to date ***")
+    print(f"Output in {args.out}/ (start from index.{args.format[0]})")
+
+
+if __name__ == "__main__":
+    main()
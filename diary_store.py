@@ -0,0 +1,298 @@
+"""Encrypted-at-rest diary store.
+
+Every record is encrypted on its own (AES-GCM or ChaCha20-Poly1305) with a
+key derived from a passphrase via scrypt, and appended to a log file. A
+fixed-size index entry per record makes appends and lookups O(1), and reads
+decrypt one record at a time so large archives can be streamed.
+
+Layout of a store directory:
+    store.json   - cipher, KDF salt/params and a key check value (no secrets)
+    records.bin  - [4-byte length][12-byte nonce][ciphertext + tag] per record
+    index.bin    - 16 bytes per record: offset, length, day ordinal
+
+The record number is bound into each record's associated data, so records
+cannot be swapped or replayed at another position without failing to decrypt.
+
+Appends (and the repair of a torn tail left by a crash mid-append) run under
+an exclusive lock on `store.lock`. Readers never modify the files: they only
+follow the index, so bytes past the last index entry are simply not seen.
+Note that the index keeps the record day in the clear so date filters don't
+need the key.
+"""
+import os
+import sys
+import hmac
+import json
+import base64
+import hashlib
+import struct
+import datetime
+import contextlib
+from pathlib import Path
+from dotenv import load_dotenv
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+except ImportError:  # Only needed when encryption is turned on
+    AESGCM = ChaCha20Poly1305 = Scrypt = InvalidTag = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+load_dotenv()
+
+STORE_VERSION = 1
+CIPHERS = {"aes-gcm": lambda key: AESGCM(key), "chacha20-poly1305": lambda key: ChaCha20Poly1305(key)}
+DEFAULT_CIPHER = "aes-gcm"
+DEFAULT_KDF = {"n": 2 ** 15, "r": 8, "p": 1}
+NONCE_SIZE = 12
+FRAME_HEADER = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<QII")  # offset, length, day ordinal
+KEY_CHECK = b"pable-diary-key-check"
+
+
+class StoreError(Exception):
+    """Raised when the store cannot be opened or a record fails to decrypt"""
+
+
+def derive_key(passphrase, salt, n, r, p):
+    return Scrypt(salt=salt, length=32, n=n, r=r, p=p).derive(passphrase.encode("utf-8"))
+
+
+def _day_ordinal(date):
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    return date.toordinal()
+
+
+class EncryptedDiaryStore:
+    def __init__(self, path, passphrase, cipher=DEFAULT_CIPHER):
+        if AESGCM is None:
+            raise StoreError("Encrypted storage requires the 'cryptography' package (pip install cryptography)")
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.meta_file = self.path / "store.json"
+        self.records_file = self.path / "records.bin"
+        self.index_file = self.path / "index.bin"
+        self.lock_file = self.path / "store.lock"
+
+        if self.meta_file.exists():
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = self._create_meta(cipher)
+
+        kdf = self.meta["kdf"]
+        key = derive_key(passphrase, base64.b64decode(self.meta["salt"]), kdf["n"], kdf["r"], kdf["p"])
+        self._aead = CIPHERS[self.meta["cipher"]](key)
+        self._mac_key = hmac.new(key, b"pable-diary-mac", hashlib.sha256).digest()
+
+        if not self.meta_file.exists():
+            self.meta["key_check"] = base64.b64encode(self._seal(KEY_CHECK, b"key-check")).decode("ascii")
+            with open(self.meta_file, 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f, indent=2)
+        else:
+            try:
+                self._open(base64.b64decode(self.meta["key_check"]), b"key-check")
+            except StoreError:
+                raise StoreError("Wrong passphrase for diary store") from None
+
+        if not self.index_file.exists():
+            self.index_file.touch()
+
+    def _create_meta(self, cipher):
+        if cipher not in CIPHERS:
+            raise StoreError(f"Unknown cipher '{cipher}'. Choose one of: {', '.join(CIPHERS)}")
+        return {
+            "version": STORE_VERSION,
+            "cipher": cipher,
+            "kdf": {"name": "scrypt", **DEFAULT_KDF},
+            "salt": base64.b64encode(os.urandom(16)).decode("ascii"),
+        }
+
+    @contextlib.contextmanager
+    def _append_lock(self):
+        """Exclusive lock across processes for appending and repairing"""
+        with open(self.lock_file, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _recover(self):
+        """Drop a torn index entry or record tail left by a crash mid-append.
+
+        Only called with the append lock held: without it, the bytes past the
+        last index entry may be a record another process is still appending.
+        """
+        index_size = self.index_file.stat().st_size
+        if index_size % INDEX_ENTRY.size:
+            with open(self.index_file, 'r+b') as f:
+                f.truncate(index_size - index_size % INDEX_ENTRY.size)
+
+        end = 0
+        if len(self):
+            offset, length, _ = self._index_entry(len(self) - 1)
+            end = offset + length
+        if self.records_file.exists() and self.records_file.stat().st_size > end:
+            with open(self.records_file, 'r+b') as f:
+                f.truncate(end)
+
+    def _seal(self, plaintext, aad):
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self._aead.encrypt(nonce, plaintext, aad)
+
+    def _open(self, sealed, aad):
+        try:
+            return self._aead.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], aad)
+        except InvalidTag:
+            raise StoreError("Record failed authentication (corrupted or tampered)") from None
+
+    def seal_text(self, text, context):
+        """Encrypt a string with the store key (for data kept outside the store)"""
+        return base64.b64encode(self._seal(text.encode("utf-8"), context)).decode("ascii")
+
+    def open_text(self, sealed, context):
+        return self._open(base64.b64decode(sealed), context).decode("utf-8")
+
+    def seal_bytes(self, data, context):
+        """Encrypt binary data with the store key (nonce + ciphertext + tag)"""
+        return self._seal(data, context)
+
+    def open_bytes(self, sealed, context):
+        return self._open(sealed, context)
+
+    def mac(self, data):
+        """Keyed SHA-256 of `data`, for names that must not reveal the content"""
+        return hmac.new(self._mac_key, data, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def _aad(record_id):
+        return struct.pack("<Q", record_id)
+
+    def __len__(self):
+        return self.index_file.stat().st_size // INDEX_ENTRY.size
+
+    def _index_entry(self, record_id):
+        with open(self.index_file, 'rb') as f:
+            f.seek(record_id * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+    def append(self, kind, date, data):
+        """Encrypt and append one record; returns its record id"""
+        payload = json.dumps({"kind": kind, "date": date, "data": data}, ensure_ascii=False).encode("utf-8")
+        with self._append_lock():
+            self._recover()
+            record_id = len(self)
+            sealed = self._seal(payload, self._aad(record_id))
+
+            with open(self.records_file, 'ab') as f:
+                offset = f.tell()
+                f.write(FRAME_HEADER.pack(len(sealed)) + sealed)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.index_file, 'ab') as f:
+                f.write(INDEX_ENTRY.pack(offset, FRAME_HEADER.size + len(sealed), _day_ordinal(date)))
+                f.flush()
+                os.fsync(f.fileno())
+
+        return record_id
+
+    def _decrypt_frame(self, record_id, frame):
+        (length,) = FRAME_HEADER.unpack_from(frame)
+        record = json.loads(self._open(frame[FRAME_HEADER.size:FRAME_HEADER.size + length], self._aad(record_id)))
+        record["id"] = record_id
+        return record
+
+    def get(self, record_id):
+        """Decrypt a single record by id"""
+        if not 0 <= record_id < len(self):
+            raise IndexError(f"No record {record_id} in store")
+        offset, length, _ = self._index_entry(record_id)
+        with open(self.records_file, 'rb') as f:
+            f.seek(offset)
+            return self._decrypt_frame(record_id, f.read(length))
+
+    def iter_records(self, kind=None, start=None, end=None, by_day=False):
+        """Yield decrypted records one at a time, in append order.
+
+        `start`/`end` (dates, inclusive) are checked against the index so
+        records outside the range are never read or decrypted. With
+        `by_day`, records come in order of their day instead (a finalized
+        recovered session can be appended after newer records); the order
+        is worked out from the index alone, without decrypting anything.
+        """
+        start = _day_ordinal(start) if start else None
+        end = _day_ordinal(end) if end else None
+
+        def wanted(index):
+            record_id = 0
+            while True:
+                entry = index.read(INDEX_ENTRY.size)
+                if len(entry) < INDEX_ENTRY.size:
+                    break
+                offset, length, day = INDEX_ENTRY.unpack(entry)
+                if (start is None or day >= start) and (end is None or day <= end):
+                    yield day, record_id, offset, length
+                record_id += 1
+
+        with open(self.index_file, 'rb') as index, open(self.records_file, 'rb') as records:
+            entries = sorted(wanted(index)) if by_day else wanted(index)
+            for _, record_id, offset, length in entries:
+                records.seek(offset)
+                record = self._decrypt_frame(record_id, records.read(length))
+                if kind is None or record["kind"] == kind:
+                    yield record
+
+
+def open_store_from_env():
+    """Return the encrypted store if DIARY_PASSPHRASE is set, otherwise None"""
+    passphrase = os.getenv('DIARY_PASSPHRASE')
+    if not passphrase:
+        return None
+    return EncryptedDiaryStore(
+        os.getenv('DIARY_STORE_DIR', 'diary_store'),
+        passphrase,
+        cipher=os.getenv('DIARY_CIPHER', DEFAULT_CIPHER)
+    )
+
+
+def main(args):
+    """Browse the encrypted store: `list [YYYY-MM-DD [YYYY-MM-DD]]` or `show ID`"""
+    store = open_store_from_env()
+    if store is None:
+        print("Set DIARY_PASSPHRASE (and optionally DIARY_STORE_DIR) to open the encrypted store.")
+        return
+
+    if args and args[0] == "show" and len(args) == 2:
+        print(json.dumps(store.get(int(args[1])), ensure_ascii=False, indent=2))
+    elif not args or args[0] == "list":
+        start = args[1] if len(args) > 1 else None
+        end = args[2] if len(args) > 2 else None
+        for record in store.iter_records(start=start, end=end):
+            print(f"{record['id']:>6}  {record['date'][:10]}  {record['kind']}")
+    else:
+        print(main.__doc__)
+
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv[1:])
+    except StoreError as e:
+        print(f"Store Error: {e}")
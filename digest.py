@@ -0,0 +1,303 @@
+"""Hierarchical digests across days: day -> week -> month.
+
+    python digest.py update [--data-dir .] [--dry-run]     # nightly, e.g. from cron
+    python digest.py show day|week|month [KEY] [--update]  # KEY: 2025-08-01, 2025-W31, 2025-08
+
+Entries are read from the same sources as the export (diary_entries.json,
+the voice day files and the encrypted store). Every digest is cached in
+DIGEST_DIR (default `digests/`) together with a hash of its inputs:
+
+- a day hashes the fingerprints of its entries,
+- a week hashes the hashes of its days,
+- a month hashes the hashes of its weeks, or of its days where an ISO
+  week straddles the month boundary.
+
+An update only rebuilds nodes whose hash changed, bottom up, so editing one
+entry costs at most one day, one week and one month call, and a monthly
+reflection is a single small call over cached digests. A day with a single
+entry reuses that entry's summary as-is (no call). Weeks are ISO weeks; a
+month uses the digests of the weeks that lie wholly inside it and the day
+digests of its days in the weeks at either edge, so it covers exactly its
+calendar days. Entries whose summary is still pending are left out until
+the batch fills them in.
+
+With an encrypted store, cached digests are sealed with the store key.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+from diary_store import open_store_from_env, StoreError
+from diary_export import iter_archive
+from batch_summaries import PENDING_SUMMARY
+
+load_dotenv()
+
+DIGEST_VERSION = 1  # Bump (or change a prompt) to rebuild every digest
+LEVELS = ("day", "week", "month")
+MAX_TOKENS = {"day": 250, "week": 300, "month": 350}
+
+PROMPTS = {
+    "day": "These are several diary entries written on the same day. Merge them into one first-person diary "
+           "entry for the day. Keep the emotional highlights and key events. Write in the same language as the entries.",
+    "week": "These are one person's daily diary digests for one week. Write a short first-person reflection on "
+            "the week: how I felt overall, what stood out, patterns or changes in mood, and anything worth carrying "
+            "into next week. One or two paragraphs. Write in the same language as the digests.",
+    "month": "These are one person's weekly reflections for one month (with daily digests for days in weeks that "
+             "cross into another month). Write a first-person monthly reflection: "
+             "the main themes, how my mood developed, highlights and difficulties, and what I learned. Two or three "
+             "paragraphs. Write in the same language as the reflections.",
+}
+
+
+def _digest_dir():
+    return Path(os.getenv('DIGEST_DIR', 'digests'))
+
+
+def _hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def week_key(day):
+    year, week, _ = datetime.date.fromisoformat(day).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_in_one_month(week):
+    """True if every day of the ISO week falls in the same calendar month"""
+    year, number = week.split("-W")
+    monday = datetime.date.fromisocalendar(int(year), int(number), 1)
+    return monday.month == (monday + datetime.timedelta(days=6)).month
+
+
+def week_label(week):
+    year, number = week.split("-W")
+    monday = datetime.date.fromisocalendar(int(year), int(number), 1)
+    sunday = monday + datetime.timedelta(days=6)
+    return f"{week} ({monday.strftime('%b %d')} - {sunday.strftime('%b %d')})"
+
+
+def _usable(entry):
+    summary = entry["summary"] if isinstance(entry["summary"], str) else ""
+    return summary.strip() and summary != PENDING_SUMMARY
+
+
+def scan_days(entries):
+    """Pass one: per-day input hash and entry count (no text is kept)"""
+    days = {}
+    for entry in entries:
+        if not _usable(entry):
+            continue
+        day = days.get(entry["day"])
+        if day is None:
+            day = days[entry["day"]] = {"hash": hashlib.sha256(f"{DIGEST_VERSION}:{PROMPTS['day']}".encode()), "entries": 0}
+        day["hash"].update(entry["fingerprint"])
+        day["entries"] += 1
+    for day in days.values():
+        day["hash"] = day["hash"].hexdigest()
+    return days
+
+
+def _child_level(key):
+    """Month children are week keys (2025-W31) or day keys (2025-08-01)"""
+    return "week" if "-W" in key else "day"
+
+
+def plan(days):
+    """Hash tree {level: {key: {"hash", "children"}}} built from the day hashes"""
+    tree = {"day": {day: {"hash": info["hash"], "children": [], "entries": info["entries"]}
+                    for day, info in days.items()}}
+    weeks, months = {}, {}
+    for day in sorted(tree["day"]):
+        week = week_key(day)
+        weeks.setdefault(week, []).append(day)
+        children = months.setdefault(day[:7], [])
+        if not week_in_one_month(week):
+            children.append(day)  # Edge week: only this month's days count
+        elif week not in children:
+            children.append(week)
+    for level, groups in (("week", weeks), ("month", months)):
+        tree[level] = {
+            key: {
+                "hash": _hash(DIGEST_VERSION, PROMPTS[level],
+                              *(f"{c}={tree[_child_level(c)][c]['hash']}" for c in children)),
+                "children": children,
+            }
+            for key, children in groups.items()
+        }
+    return tree
+
+
+class DigestEngine:
+    def __init__(self, data_dir=".", store=None, client=None, summarize=None):
+        self.data_dir = data_dir
+        self.store = store
+        self.requests = None
+        if summarize is None and client is not None:
+            from request_layer import RequestLayer
+            self.requests = RequestLayer(client)
+        self.summarize = summarize or self._summarize
+        self.cache_path = _digest_dir() / "cache.json"
+        self.cache = self._load()
+
+    def _load(self):
+        if self.cache_path.exists():
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get("version") == DIGEST_VERSION:
+                return cache
+        return {"version": DIGEST_VERSION, **{level: {} for level in LEVELS}}
+
+    def _save(self):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def _seal(self, text):
+        return self.store.seal_text(text, b"digest") if self.store is not None else text
+
+    def get(self, level, key):
+        """Cached digest text, or None if it hasn't been built"""
+        node = self.cache[level].get(key)
+        if node is None:
+            return None
+        return self.store.open_text(node["summary"], b"digest") if self.store is not None else node["summary"]
+
+    def _summarize(self, level, key, text):
+        response, _ = self.requests.chat(dict(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": PROMPTS[level]},
+                {"role": "user", "content": text}
+            ],
+            max_tokens=MAX_TOKENS[level],
+            temperature=0.7
+        ))
+        return response.choices[0].message.content.strip()
+
+    def _day_texts(self, days):
+        """Pass two: the summaries of the given days only"""
+        texts = {}
+        for entry in iter_archive(self.data_dir, self.store):
+            if entry["day"] in days and _usable(entry):
+                texts.setdefault(entry["day"], []).append(entry["summary"].strip())
+        return texts
+
+    def _child_text(self, children):
+        parts = []
+        for child in children:
+            if _child_level(child) == "week":
+                parts.append(f"Week {week_label(child)}:\n{self.get('week', child)}")
+            else:
+                parts.append(f"{datetime.date.fromisoformat(child).strftime('%A')} {child}:\n{self.get('day', child)}")
+        return "\n\n".join(parts)
+
+    def update(self, dry_run=False):
+        """Rebuild every digest whose inputs changed; returns {level: (rebuilt, cached)}"""
+        tree = plan(scan_days(iter_archive(self.data_dir, self.store)))
+        stale = {
+            level: sorted(key for key, node in tree[level].items()
+                          if self.cache[level].get(key, {}).get("hash") != node["hash"])
+            for level in LEVELS
+        }
+        result = {level: (len(stale[level]), len(tree[level]) - len(stale[level])) for level in LEVELS}
+        if dry_run:
+            return result
+
+        for level in LEVELS:
+            cached = self.cache[level]
+            for key in set(cached) - set(tree[level]):
+                del cached[key]  # Entries for this period are gone
+
+            if level == "day":
+                texts = self._day_texts(set(stale["day"]))
+            for key in stale[level]:
+                node = tree[level][key]
+                if level == "day":
+                    parts = texts.get(key, [])
+                    if not parts:
+                        continue
+                    summary = parts[0] if len(parts) == 1 else self.summarize(
+                        "day", key, "\n\n".join(f"Entry {i + 1}:\n{part}" for i, part in enumerate(parts)))
+                else:
+                    summary = self.summarize(level, key, self._child_text(node["children"]))
+                cached[key] = {
+                    "hash": node["hash"],
+                    "summary": self._seal(summary),
+                    "children": node["children"],
+                    "built": time.time(),
+                }
+            self._save()  # Progress per level survives an interrupted run
+        return result
+
+
+def _default_key(level):
+    today = datetime.date.today().isoformat()
+    return {"day": today, "week": week_key(today), "month": today[:7]}[level]
+
+
+def _make_engine(args, store, need_client):
+    client = None
+    if need_client:
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return DigestEngine(args.data_dir, store, client)
+
+
+def _print_update(engine, result, dry_run):
+    verb = "Would rebuild" if dry_run else "Rebuilt"
+    print(f"*** {verb} " + ", ".join(f"{rebuilt} {level}(s)" for level, (rebuilt, _) in result.items()) +
+          " - cached: " + ", ".join(f"{cached} {level}(s)" for level, (_, cached) in result.items()) + " ***")
+    if engine.requests is not None and engine.requests.stats["requests"]:
+        for line in engine.requests.report():
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Day, week and month digests of the diary")
+    parser.add_argument("--data-dir", default=".", help="Directory with diary_entries.json and voice day files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    update = sub.add_parser("update", help="Bring every digest up to date (run nightly)")
+    update.add_argument("--dry-run", action="store_true", help="Only report what would be rebuilt")
+    show = sub.add_parser("show", help="Print a digest")
+    show.add_argument("level", choices=LEVELS)
+    show.add_argument("key", nargs="?", help="2025-08-01, 2025-W31 or 2025-08 (default: current)")
+    show.add_argument("--update", action="store_true", help="Update digests first")
+    args = parser.parse_args(argv)
+
+    try:
+        store = open_store_from_env()
+    except StoreError as e:
+        print(f"Store Error: {e}")
+        return
+
+    if args.command == "update":
+        engine = _make_engine(args, store, need_client=not args.dry_run)
+        _print_update(engine, engine.update(args.dry_run), args.dry_run)
+        return
+
+    engine = _make_engine(args, store, need_client=args.update)
+    if args.update:
+        _print_update(engine, engine.update(), dry_run=False)
+    key = args.key or _default_key(args.level)
+    summary = engine.get(args.level, key)
+    if summary is None:
+        print(f"No {args.level} digest for {key}. Run `python digest.py update` first.")
+        return
+    title = week_label(key) if args.level == "week" else key
+    print(f"\n=== {args.level.capitalize()} {title} ===\n")
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
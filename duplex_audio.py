@@ -0,0 +1,172 @@
+"""Full-duplex audio for barge-in: an always-on mic listener with a simple
+energy VAD, and a player whose playback can be cut off at any moment.
+
+While something is playing, the VAD threshold is raised (`playback_gain`) so
+the assistant's own voice leaking from the speakers is less likely to count
+as the user talking. Headphones avoid the problem entirely.
+"""
+import time
+import queue
+import platform
+import threading
+import subprocess
+from collections import deque
+import numpy as np
+from audio_utils import AudioBuffer
+
+
+def frame_rms(data):
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    if len(samples) == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+class MicListener:
+    """Reads the mic on a background thread and cuts it into utterances.
+
+    `on_speech_start(detected_at)` is called from the listener thread as soon
+    as speech begins (used for barge-in); finished utterances are returned
+    by next_utterance() as AudioBuffers.
+    """
+
+    def __init__(self, audio, rate, chunk, sample_format, channels, threshold, silence_duration,
+                 on_speech_start=None, start_frames=3, preroll_seconds=0.3, playback_gain=2.5):
+        self.audio = audio
+        self.rate = rate
+        self.chunk = chunk
+        self.sample_format = sample_format
+        self.channels = channels
+        self.threshold = threshold
+        self.silence_duration = silence_duration
+        self.on_speech_start = on_speech_start
+        self.start_frames = start_frames
+        self.preroll_chunks = max(1, int(preroll_seconds * rate / chunk))
+        self.playback_gain = playback_gain
+        self.playback_active = threading.Event()
+        self.utterances = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stream = None
+
+    def start(self):
+        self._stream = self.audio.open(
+            format=self.sample_format,
+            channels=self.channels,
+            rate=self.rate,
+            input=True,
+            frames_per_buffer=self.chunk
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+
+    def next_utterance(self, timeout=0.1):
+        try:
+            return self.utterances.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        preroll = deque(maxlen=self.preroll_chunks)
+        voiced_run = 0
+        silence = 0.0
+        buffer = None
+        chunk_seconds = self.chunk / self.rate
+
+        while not self._stop.is_set():
+            try:
+                data = self._stream.read(self.chunk, exception_on_overflow=False)
+            except Exception:
+                break
+            rms = frame_rms(data)
+
+            if buffer is None:
+                preroll.append(data)
+                threshold = self.threshold * (self.playback_gain if self.playback_active.is_set() else 1.0)
+                voiced_run = voiced_run + 1 if rms > threshold else 0
+                if voiced_run >= self.start_frames:
+                    detected_at = time.perf_counter()
+                    buffer = AudioBuffer(self.rate)
+                    for frame in preroll:
+                        buffer.append(frame)
+                    preroll.clear()
+                    silence = 0.0
+                    if self.on_speech_start:
+                        self.on_speech_start(detected_at)
+            else:
+                buffer.append(data)
+                silence = silence + chunk_seconds if rms < self.threshold else 0.0
+                if silence >= self.silence_duration:
+                    self.utterances.put(buffer)
+                    buffer = None
+                    voiced_run = 0
+
+
+class InterruptiblePlayer:
+    """Plays an audio file in a subprocess that stop() can kill immediately.
+
+    `on_interrupted(stopped_at)` is called from play() once a cancelled
+    playback's process has actually exited (perf_counter timestamp).
+    """
+
+    def __init__(self, playback_active=None, command=None, on_interrupted=None):
+        self.playback_active = playback_active
+        self.command = command
+        self.on_interrupted = on_interrupted
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _command(self, path):
+        if self.command:
+            return self.command + [path]
+        if platform.system() == "Darwin":  # macOS
+            return ["afplay", path]
+        return ["mpg123", "-q", path]
+
+    def play(self, path, cancel, timeout=30):
+        """Play until finished, `cancel` is set or timeout; True if it finished"""
+        with self._lock:
+            if cancel.is_set():
+                return False
+            self._process = subprocess.Popen(self._command(path), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if self.playback_active is not None:
+            self.playback_active.set()
+        try:
+            deadline = time.monotonic() + timeout
+            while self._process.poll() is None:
+                if cancel.wait(0.02) or time.monotonic() > deadline:
+                    self.stop()
+                    break
+            if cancel.is_set():
+                if self.on_interrupted is not None:
+                    self.on_interrupted(time.perf_counter())
+                return False
+            return time.monotonic() <= deadline
+        finally:
+            if self.playback_active is not None:
+                self.playback_active.clear()
+
+    def stop(self, wait=True):
+        """Kill current playback (safe to call from any thread).
+
+        With wait=False it only signals the player and returns at once; the
+        play() loop, which sees its cancel event, finishes the job.
+        """
+        with self._lock:
+            process = self._process
+            if process is not None and process.poll() is None:
+                process.terminate()
+                if not wait:
+                    return
+                try:
+                    process.wait(timeout=0.5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
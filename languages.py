@@ -0,0 +1,223 @@
+"""Per-session language handling.
+
+The language is worked out once per session and cached:
+- DIARY_LANGUAGE (e.g. `ko`) pins it up front, or
+- the first transcription is requested as `verbose_json`, which carries the
+  language Whisper detected, so detection costs no extra request, or
+- for typed input, a local script/stopword detector guesses from the text.
+
+After that every STT call passes the cached `language`, chat prompts get a
+one-line "reply in ..." instruction after the unchanged static system prompt
+(so provider prompt caching still applies) and TTS uses the language's voice.
+Voices can be overridden with TTS_VOICE_<CODE>, e.g. TTS_VOICE_KO=alloy.
+
+STT accepts any language Whisper knows. Prompts, voices and the apps' fixed
+texts (greeting, question list) only switch for the languages in LANGUAGES;
+anything else keeps them in English.
+"""
+import os
+import re
+import json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_LANGUAGE = "en"
+
+# ISO 639-1 code -> (Whisper language name, display name, TTS voice)
+LANGUAGES = {
+    "en": ("english", "English", "nova"),
+    "ko": ("korean", "Korean", "nova"),
+    "ja": ("japanese", "Japanese", "shimmer"),
+    "zh": ("chinese", "Chinese", "shimmer"),
+    "es": ("spanish", "Spanish", "nova"),
+    "fr": ("french", "French", "shimmer"),
+    "de": ("german", "German", "alloy"),
+    "pt": ("portuguese", "Portuguese", "nova"),
+    "it": ("italian", "Italian", "nova"),
+    "ru": ("russian", "Russian", "alloy"),
+    "ar": ("arabic", "Arabic", "alloy"),
+    "hi": ("hindi", "Hindi", "nova"),
+}
+
+# Every language Whisper transcribes: code -> name as reported in verbose_json
+WHISPER_LANGUAGES = {
+    "en": "english", "zh": "chinese", "de": "german", "es": "spanish", "ru": "russian", "ko": "korean",
+    "fr": "french", "ja": "japanese", "pt": "portuguese", "tr": "turkish", "pl": "polish", "ca": "catalan",
+    "nl": "dutch", "ar": "arabic", "sv": "swedish", "it": "italian", "id": "indonesian", "hi": "hindi",
+    "fi": "finnish", "vi": "vietnamese", "he": "hebrew", "uk": "ukrainian", "el": "greek", "ms": "malay",
+    "cs": "czech", "ro": "romanian", "da": "danish", "hu": "hungarian", "ta": "tamil", "no": "norwegian",
+    "th": "thai", "ur": "urdu", "hr": "croatian", "bg": "bulgarian", "lt": "lithuanian", "la": "latin",
+    "mi": "maori", "ml": "malayalam", "cy": "welsh", "sk": "slovak", "te": "telugu", "fa": "persian",
+    "lv": "latvian", "bn": "bengali", "sr": "serbian", "az": "azerbaijani", "sl": "slovenian", "kn": "kannada",
+    "et": "estonian", "mk": "macedonian", "br": "breton", "eu": "basque", "is": "icelandic", "hy": "armenian",
+    "ne": "nepali", "mn": "mongolian", "bs": "bosnian", "kk": "kazakh", "sq": "albanian", "sw": "swahili",
+    "gl": "galician", "mr": "marathi", "pa": "punjabi", "si": "sinhala", "km": "khmer", "sn": "shona",
+    "yo": "yoruba", "so": "somali", "af": "afrikaans", "oc": "occitan", "ka": "georgian", "be": "belarusian",
+    "tg": "tajik", "sd": "sindhi", "gu": "gujarati", "am": "amharic", "yi": "yiddish", "lo": "lao",
+    "uz": "uzbek", "fo": "faroese", "ht": "haitian creole", "ps": "pashto", "tk": "turkmen", "nn": "nynorsk",
+    "mt": "maltese", "sa": "sanskrit", "lb": "luxembourgish", "my": "myanmar", "bo": "tibetan", "tl": "tagalog",
+    "mg": "malagasy", "as": "assamese", "tt": "tatar", "ln": "lingala", "ha": "hausa", "ba": "bashkir",
+    "jw": "javanese", "su": "sundanese",
+}
+_BY_NAME = {name: code for code, name in WHISPER_LANGUAGES.items()}
+
+LOCALIZE_PROMPT = ("Translate each string in the JSON list into {name}. Keep the tone warm and natural. "
+                   'Answer with a JSON object {{"texts": [...]}} holding the translations in the same order.')
+
+# Scripts that identify a language on their own (checked in order)
+_SCRIPTS = [
+    ("ko", re.compile(r"[가-힣ᄀ-ᇿ㄰-㆏]")),
+    ("ja", re.compile(r"[぀-ヿ]")),
+    ("zh", re.compile(r"[一-鿿]")),
+    ("ru", re.compile(r"[Ѐ-ӿ]")),
+    ("ar", re.compile(r"[؀-ۿ]")),
+    ("hi", re.compile(r"[ऀ-ॿ]")),
+]
+
+# Frequent short words to tell Latin-script languages apart
+_STOPWORDS = {
+    "en": {"the", "and", "i", "was", "to", "it", "is", "my", "of", "a", "that", "today", "with", "but"},
+    "es": {"el", "la", "y", "que", "de", "fue", "mi", "es", "un", "una", "con", "pero", "hoy", "muy"},
+    "fr": {"le", "la", "et", "je", "est", "de", "un", "une", "que", "mais", "avec", "aujourd'hui", "très", "j'ai"},
+    "de": {"der", "die", "und", "ich", "ist", "das", "nicht", "ein", "eine", "mit", "aber", "heute", "sehr", "war"},
+    "pt": {"o", "a", "e", "que", "de", "foi", "meu", "um", "uma", "com", "mas", "hoje", "muito", "não"},
+    "it": {"il", "la", "e", "che", "di", "è", "un", "una", "con", "ma", "oggi", "molto", "sono", "non"},
+}
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+
+def normalize_code(value):
+    """Map 'ko', 'KO', 'korean' or 'ko-KR' to a Whisper language code, else None"""
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value in _BY_NAME:
+        return _BY_NAME[value]
+    value = value.split("-")[0].split("_")[0]
+    return value if value in WHISPER_LANGUAGES else None
+
+
+def detect_text_language(text, min_words=3):
+    """Cheap local guess from the text alone; None when it can't tell"""
+    if not text:
+        return None
+    for code, pattern in _SCRIPTS:
+        if len(pattern.findall(text)) >= 2:
+            return code
+
+    words = [w.lower() for w in _WORD.findall(text)]
+    if len(words) < min_words:
+        return None
+    scores = {code: sum(1 for w in words if w in stopwords) for code, stopwords in _STOPWORDS.items()}
+    best = max(scores, key=scores.get)
+    ranked = sorted(scores.values(), reverse=True)
+    if ranked[0] == 0 or ranked[0] == ranked[1]:
+        return None
+    return best
+
+
+class SessionLanguage:
+    def __init__(self, code=None):
+        code = normalize_code(code if code is not None else os.getenv('DIARY_LANGUAGE'))
+        self.code = code  # Passed to STT; may be a language without prompts or a voice
+        self.source = "config" if code else None
+        self._localized = {}
+
+    @property
+    def resolved(self):
+        return self.code is not None
+
+    @property
+    def effective(self):
+        """Language for prompts, voice and fixed texts"""
+        return self.code if self.code in LANGUAGES else DEFAULT_LANGUAGE
+
+    @property
+    def name(self):
+        return LANGUAGES[self.effective][1]
+
+    @property
+    def voice(self):
+        return os.getenv(f'TTS_VOICE_{self.effective.upper()}', LANGUAGES[self.effective][2])
+
+    def _set(self, code, source):
+        if self.code is None and code:
+            self.code = code
+            self.source = source
+            if code not in LANGUAGES:
+                print(f"*** Language: {WHISPER_LANGUAGES[code].title()} (replies and voice stay in {self.name}) ***")
+            elif code != DEFAULT_LANGUAGE:
+                print(f"*** Language: {self.name} ***")
+
+    def transcription_options(self):
+        """Extra transcriptions.create() arguments for the next STT call"""
+        if self.code is not None:
+            return {"language": self.code}
+        # Until the language is known, ask Whisper to report what it detected
+        return {"response_format": "verbose_json"}
+
+    def observe_transcription(self, response):
+        """Cache the language from the first transcription of the session.
+
+        Whisper's own answer always wins; the text detector is only used when
+        the response carries no language at all.
+        """
+        if self.code is None:
+            reported = getattr(response, "language", None)
+            if reported:
+                self._set(normalize_code(reported), "stt")
+            else:
+                self._set(detect_text_language(response.text), "text")
+
+    def observe_text(self, text):
+        """Cache the language from typed text (local detector, no API call)"""
+        if self.code is None:
+            self._set(detect_text_language(text), "text")
+
+    def instruction(self):
+        """System message for chat prompts, or None for the default language"""
+        if self.effective == DEFAULT_LANGUAGE:
+            return None
+        return (f"Always write your reply in {self.name}. "
+                "Keep any EMOTION_ANALYSIS tag and its emotion word in English.")
+
+    def localize(self, requests, texts, allow_call=None):
+        """`texts` in the session language via one cached chat call; unchanged on failure.
+
+        `allow_call()` is asked before the translation request is sent (e.g. an
+        API budget); when it returns False the texts stay untranslated.
+        """
+        texts = list(texts)
+        if self.effective == DEFAULT_LANGUAGE:
+            return texts
+        key = (self.effective, tuple(texts))
+        if key not in self._localized:
+            if allow_call is not None and not allow_call():
+                return texts
+            try:
+                response, _ = requests.chat(dict(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": LOCALIZE_PROMPT.format(name=self.name)},
+                        {"role": "user", "content": json.dumps(texts, ensure_ascii=False)}
+                    ],
+                    response_format={"type": "json_object"},
+                    temperature=0
+                ))
+                localized = json.loads(response.choices[0].message.content)["texts"]
+                if len(localized) != len(texts) or not all(isinstance(t, str) and t.strip() for t in localized):
+                    raise ValueError("unexpected translation output")
+                self._localized[key] = localized
+            except Exception as e:
+                print(f"Translation Error: {str(e)}")
+                return texts
+        return self._localized[key]
+
+    def system_messages(self, static_prompt):
+        """The static prompt first (cacheable prefix), then the language line"""
+        messages = [{"role": "system", "content": static_prompt}]
+        instruction = self.instruction()
+        if instruction:
+            messages.append({"role": "system", "content": instruction})
+        return messages
@@ -0,0 +1,153 @@
+"""Client-side layer in front of chat completions.
+
+- Identical requests that are already in flight are coalesced: later
+  callers wait for the first call's result instead of paying again.
+- Idempotent calls can pass `memo_ttl` to reuse a recent identical response
+  (e.g. a repeated "I'm fine", or a retry right after a transient error).
+- `stream()` runs a call that can be abandoned midway (full-duplex turns):
+  the reply streams in and closing the stream stops generation.
+- Token usage is tracked, including how much of each prompt the provider
+  served from its prompt cache. Provider-side caching only applies when a
+  request starts with the same prefix as an earlier one, so the apps keep
+  their static system prompt as a module constant and always send it first.
+"""
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+
+DEFAULT_MEMO_TTL = 60  # seconds
+MAX_MEMO_ENTRIES = 256
+
+
+class RequestLayer:
+    def __init__(self, client, max_memo_entries=MAX_MEMO_ENTRIES):
+        self.client = client
+        self.max_memo_entries = max_memo_entries
+        self._memo = {}  # key -> (expires, response)
+        self._in_flight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "api_calls": 0,
+            "memo_hits": 0,
+            "coalesced": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0,
+            "completion_tokens": 0,
+            "tokens_saved": 0,
+        }
+
+    @staticmethod
+    def _key(request):
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _usage(response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return 0, 0, 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        return usage.prompt_tokens or 0, cached, usage.completion_tokens or 0
+
+    def _record_call(self, response):
+        self.stats["api_calls"] += 1
+        prompt, cached, completion = self._usage(response)
+        self.stats["prompt_tokens"] += prompt
+        self.stats["cached_prompt_tokens"] += cached
+        self.stats["completion_tokens"] += completion
+
+    def _count_saved(self, response):
+        prompt, _, completion = self._usage(response)
+        self.stats["tokens_saved"] += prompt + completion
+
+    def _remember(self, key, response, ttl):
+        now = time.monotonic()
+        if len(self._memo) >= self.max_memo_entries:
+            for old_key in [k for k, (expires, _) in self._memo.items() if expires <= now]:
+                del self._memo[old_key]
+            while len(self._memo) >= self.max_memo_entries:
+                del self._memo[next(iter(self._memo))]
+        self._memo[key] = (now + ttl, response)
+
+    def chat(self, request, memo_ttl=0):
+        """Run a chat completion; returns (response, served_without_a_new_call)"""
+        key = self._key(request)
+
+        with self._lock:
+            self.stats["requests"] += 1
+            memo = self._memo.get(key)
+            if memo is not None and memo[0] > time.monotonic():
+                self.stats["memo_hits"] += 1
+                self._count_saved(memo[1])
+                return memo[1], True
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+
+        if not owner:
+            response = future.result()
+            with self._lock:
+                self._count_saved(response)
+            return response, True
+
+        # BaseException too: a Ctrl+C in the owner must not leave waiters blocked
+        # on a future that never completes, or the key stuck in _in_flight
+        try:
+            response = self.client.chat.completions.create(**request)
+            with self._lock:
+                self._record_call(response)
+                if memo_ttl:
+                    self._remember(key, response, memo_ttl)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response, False
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+
+    def stream(self, request, cancel):
+        """Run a chat completion as a stream; returns the text, or None if `cancel` was set.
+
+        Closing the stream drops the HTTP response, so the provider stops
+        generating a reply nobody will hear. Never coalesced or memoized.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+        stream = self.client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+        parts, last = [], None
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    return None
+                last = chunk  # The final chunk carries the usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            stream.close()
+            with self._lock:
+                self._record_call(last)
+        return "".join(parts)
+
+    def report(self):
+        """Lines for the end-of-session report"""
+        s = self.stats
+        reused = s["memo_hits"] + s["coalesced"]
+        hit_rate = reused / s["requests"] * 100 if s["requests"] else 0
+        cache_rate = s["cached_prompt_tokens"] / s["prompt_tokens"] * 100 if s["prompt_tokens"] else 0
+        return [
+            f"Chat requests: {s['requests']} ({s['api_calls']} sent, {s['memo_hits']} memo hits, "
+            f"{s['coalesced']} coalesced - {hit_rate:.0f}% reused)",
+            f"Tokens: {s['prompt_tokens']} prompt ({s['cached_prompt_tokens']} from provider cache, {cache_rate:.0f}%), "
+            f"{s['completion_tokens']} completion, {s['tokens_saved']} saved by reuse",
+        ]
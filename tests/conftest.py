@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+# The app modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def text_entry(date, text):
+    """A diary_entries.json entry written on `date` (YYYY-MM-DD)"""
+    return {"date": f"{date}T21:00:00", "conversation": f"Q: How was today?\nA: {text}", "diary_entry": text}
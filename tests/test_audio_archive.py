@@ -0,0 +1,24 @@
+import numpy as np
+
+from audio_archive import AudioArchive
+
+
+def _noise(seconds, seed, rate=16000):
+    return np.random.default_rng(seed).integers(-8000, 8000, int(seconds * rate), dtype=np.int16)
+
+
+def test_utterance_larger_than_the_cap_is_not_linked(tmp_path):
+    archive = AudioArchive(tmp_path, max_bytes=3000)
+    assert archive.add(_noise(1, seed=0), 16000) is None
+    assert archive.index == {}
+    assert not list(tmp_path.glob("*/*"))
+
+
+def test_prune_never_evicts_the_utterance_just_added(tmp_path):
+    archive = AudioArchive(tmp_path)
+    first = archive.add(_noise(0.5, seed=1), 16000)
+    archive.max_bytes = archive.index[first]["bytes"] + 100  # Room for one utterance only
+
+    second = archive.add(_noise(0.5, seed=2), 16000)
+    assert second in archive.index and first not in archive.index
+    assert archive.get_wav(second) is not None
@@ -0,0 +1,58 @@
+import json
+
+import batch_summaries
+from batch_summaries import LocalBatchBackend, collect, enqueue_summary, submit
+
+
+class FlakyBackend(LocalBatchBackend):
+    """Local backend whose first `failures` batches fail as a whole"""
+
+    def __init__(self, complete, failures):
+        super().__init__(complete)
+        self.failures = failures
+
+    def poll(self, batch_id):
+        results = super().poll(batch_id)
+        if self.failures:
+            self.failures -= 1
+            return {batch_summaries.BATCH_FAILED: (None, "batch expired")}
+        return results
+
+
+def _queue_day_file(tmp_path, job_id):
+    day_file = tmp_path / "voice_diary_2025-08-01.json"
+    day_file.write_text(json.dumps({"diary_entry": "pending", "summary_job": job_id}), encoding="utf-8")
+    enqueue_summary(job_id, {"messages": [{"role": "user", "content": "a day"}]},
+                    {"type": "day_file", "path": str(day_file), "key": "diary_entry"})
+    return day_file
+
+
+def test_failed_batch_requeues_its_jobs(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUMMARY_JOBS_DIR", str(tmp_path / "jobs"))
+    day_file = _queue_day_file(tmp_path, "job1")
+    backend = FlakyBackend(lambda request: "A good day.", failures=1)
+
+    submit(backend)
+    assert collect({backend.name: backend}) == (0, 0)
+    requeued = json.loads((tmp_path / "jobs" / "queued" / "job1.json").read_text(encoding="utf-8"))
+    assert requeued["attempts"] == 1 and "batch" not in requeued
+
+    submit(backend)
+    assert collect({backend.name: backend}) == (1, 0)
+    assert json.loads(day_file.read_text(encoding="utf-8")) == {"diary_entry": "A good day."}
+
+
+def test_job_fails_after_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUMMARY_JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setenv("SUMMARY_MAX_ATTEMPTS", "2")
+    day_file = _queue_day_file(tmp_path, "job1")
+    backend = FlakyBackend(lambda request: "A good day.", failures=2)
+
+    submit(backend)
+    assert collect({backend.name: backend}) == (0, 0)
+    submit(backend)
+    assert collect({backend.name: backend}) == (0, 1)
+    done = json.loads((tmp_path / "jobs" / "done" / "job1.json").read_text(encoding="utf-8"))
+    assert done["error"] == "batch expired"
+    assert not list((tmp_path / "jobs" / "queued").glob("*.json"))
+    assert json.loads(day_file.read_text(encoding="utf-8"))["diary_entry"] == "pending"
@@ -0,0 +1,68 @@
+import json
+
+from conftest import text_entry
+import diary_export
+from diary_export import export
+from diary_store import EncryptedDiaryStore
+
+
+def test_store_records_appended_out_of_order_stay_in_their_month(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    with open(data_dir / "diary_entries.json", 'w', encoding='utf-8') as f:
+        json.dump([text_entry("2025-08-01", "August first"), text_entry("2025-09-01", "September first")], f)
+
+    store = EncryptedDiaryStore(tmp_path / "store", "test passphrase")
+    store.append("text_entry", "2025-09-03", text_entry("2025-09-03", "September third"))
+    # A recovered session finalized later keeps its older session date
+    store.append("text_entry", "2025-08-05", text_entry("2025-08-05", "August fifth"))
+
+    out_dir = tmp_path / "exports"
+    export(data_dir, out_dir, formats=("md",), store=store)
+
+    august = (out_dir / "2025-08.md").read_text(encoding="utf-8")
+    september = (out_dir / "2025-09.md").read_text(encoding="utf-8")
+    assert "2 entries" in august
+    assert "August first" in august and "August fifth" in august
+    assert august.index("August first") < august.index("August fifth")
+    assert "September first" in september and "September third" in september
+    assert "August" not in september
+
+
+def test_iter_records_by_day_uses_index_order(tmp_path):
+    store = EncryptedDiaryStore(tmp_path / "store", "test passphrase")
+    for day in ("2025-09-03", "2025-08-05", "2025-08-20"):
+        store.append("text_entry", day, {"date": day})
+
+    assert [r["date"] for r in store.iter_records()] == ["2025-09-03", "2025-08-05", "2025-08-20"]
+    assert [r["date"] for r in store.iter_records(by_day=True)] == ["2025-08-05", "2025-08-20", "2025-09-03"]
+    assert [r["id"] for r in store.iter_records(by_day=True, start="2025-08-10")] == [2, 0]
+
+
+def test_unsorted_source_does_not_truncate_a_month(tmp_path):
+    with open(tmp_path / "diary_entries.json", 'w', encoding='utf-8') as f:
+        json.dump([text_entry("2025-08-01", "August first"), text_entry("2025-09-01", "September first"),
+                   text_entry("2025-08-05", "August fifth")], f)
+
+    export(tmp_path, tmp_path / "exports", formats=("md", "html"))
+
+    for extension in ("md", "html"):
+        august = (tmp_path / "exports" / f"2025-08.{extension}").read_text(encoding="utf-8")
+        assert "August first" in august and "August fifth" in august
+    assert not list((tmp_path / "exports").glob("*.tmp"))
+
+
+def test_reordered_months_are_rendered_in_bounded_passes(tmp_path, monkeypatch):
+    monkeypatch.setattr(diary_export, "MAX_OPEN_MONTHS", 2)
+    months = [f"2025-{number:02d}" for number in range(1, 8)]
+    entries = [text_entry(f"{month}-01", f"First of {month}") for month in months]
+    entries += [text_entry(f"{month}-20", f"Late in {month}") for month in months[:5]]
+    with open(tmp_path / "diary_entries.json", 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+
+    assert export(tmp_path, tmp_path / "exports", formats=("md",)) == months
+    for number, month in enumerate(months):
+        book = (tmp_path / "exports" / f"{month}.md").read_text(encoding="utf-8")
+        assert f"First of {month}" in book
+        assert (f"Late in {month}" in book) == (number < 5)
+    assert not list((tmp_path / "exports").glob("*.tmp"))
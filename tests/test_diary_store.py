@@ -0,0 +1,58 @@
+import pytest
+
+from diary_store import EncryptedDiaryStore, StoreError, FRAME_HEADER, INDEX_ENTRY
+
+PASSPHRASE = "test passphrase"
+
+
+def _store_with(path, *days):
+    store = EncryptedDiaryStore(path, PASSPHRASE)
+    for day in days:
+        store.append("text_entry", day, {"date": day, "diary_entry": f"Entry of {day}"})
+    return store
+
+
+def test_wrong_passphrase_is_rejected(tmp_path):
+    _store_with(tmp_path, "2025-08-01")
+    with pytest.raises(StoreError, match="Wrong passphrase"):
+        EncryptedDiaryStore(tmp_path, "not the passphrase")
+
+
+def test_modified_ciphertext_fails_authentication(tmp_path):
+    store = _store_with(tmp_path, "2025-08-01")
+    data = bytearray((tmp_path / "records.bin").read_bytes())
+    data[-1] ^= 0x01
+    (tmp_path / "records.bin").write_bytes(bytes(data))
+
+    with pytest.raises(StoreError, match="authentication"):
+        store.get(0)
+
+
+def test_records_are_bound_to_their_position(tmp_path):
+    store = _store_with(tmp_path, "2025-08-01", "2025-08-02")
+    index = (tmp_path / "index.bin").read_bytes()
+    # Point both index entries at the other record
+    (tmp_path / "index.bin").write_bytes(index[INDEX_ENTRY.size:] + index[:INDEX_ENTRY.size])
+
+    for record_id in (0, 1):
+        with pytest.raises(StoreError):
+            store.get(record_id)
+
+
+def test_torn_tail_is_left_to_readers_and_repaired_by_the_next_append(tmp_path):
+    _store_with(tmp_path, "2025-08-01")
+    records_size = (tmp_path / "records.bin").stat().st_size
+    # A crash between the record fsync and the index write, plus half an index entry
+    with open(tmp_path / "records.bin", 'ab') as f:
+        f.write(FRAME_HEADER.pack(40) + b"\0" * 40)
+    with open(tmp_path / "index.bin", 'ab') as f:
+        f.write(b"\0" * (INDEX_ENTRY.size // 2))
+
+    reader = EncryptedDiaryStore(tmp_path, PASSPHRASE)
+    assert (tmp_path / "records.bin").stat().st_size == records_size + FRAME_HEADER.size + 40
+    assert [r["date"] for r in reader.iter_records()] == ["2025-08-01"]
+
+    writer = EncryptedDiaryStore(tmp_path, PASSPHRASE)
+    assert writer.append("text_entry", "2025-08-02", {"date": "2025-08-02"}) == 1
+    assert (tmp_path / "index.bin").stat().st_size == 2 * INDEX_ENTRY.size
+    assert [r["date"] for r in reader.iter_records()] == ["2025-08-01", "2025-08-02"]
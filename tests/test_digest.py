@@ -0,0 +1,28 @@
+import json
+
+from conftest import text_entry
+from digest import DigestEngine
+
+
+def test_month_covers_exactly_its_calendar_days(tmp_path, monkeypatch):
+    monkeypatch.setenv("DIGEST_DIR", str(tmp_path / "digests"))
+    # ISO week 2025-W31 runs from Mon Jul 28 to Sun Aug 3; W32 lies wholly in August
+    days = ["2025-07-21", "2025-07-30", "2025-08-01", "2025-08-03", "2025-08-05"]
+    with open(tmp_path / "diary_entries.json", 'w', encoding='utf-8') as f:
+        json.dump([text_entry(day, f"Entry of {day}") for day in days], f)
+
+    calls = {}
+
+    def summarize(level, key, text):
+        calls[(level, key)] = text
+        return f"{level} {key}"
+
+    engine = DigestEngine(tmp_path, summarize=summarize)
+    engine.update()
+
+    july, august = calls[("month", "2025-07")], calls[("month", "2025-08")]
+    assert "Week 2025-W30" in july and "2025-07-30" in july
+    assert "2025-08-01" not in july and "2025-08-03" not in july
+    assert "2025-08-01" in august and "2025-08-03" in august and "Week 2025-W32" in august
+    assert "2025-W31" not in july + august
+    assert engine.get("week", "2025-W31") == "week 2025-W31"
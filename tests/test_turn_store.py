@@ -0,0 +1,19 @@
+import pytest
+
+from turn_store import TurnStore
+
+ITEMS = [
+    {"speaker": "user", "message": "Long day.", "timestamp": "2025-08-01T21:00:00.000013",
+     "emotion": {"dominant": "tired", "intensity": 0.123456}, "audio": "ab" * 32},
+    {"speaker": "ai", "message": "How did it end?", "timestamp": "2025-08-01T21:00:05"},
+    {"speaker": "user", "message": "No timestamp at all.", "emotion": None},
+    {"speaker": "user", "message": "Odd timestamp.", "timestamp": "yesterday", "emotion": "calm"},
+]
+
+
+@pytest.mark.parametrize("spill_bytes", [1 << 40, 1])
+def test_turns_read_back_as_the_same_dicts(spill_bytes):
+    turns = TurnStore(ITEMS, spill_bytes=spill_bytes)
+    assert list(turns) == ITEMS
+    assert turns[2] == ITEMS[2] and "timestamp" not in turns[2]
+    turns.close()
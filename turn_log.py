@@ -0,0 +1,183 @@
+"""Write-ahead log of conversation turns for crash recovery.
+
+Every conversation item is appended to `sessions/<app>_<id>.wal` as it
+happens. Writes go into a buffered file and a background thread flushes and
+fsyncs them together every `sync_interval` seconds (group commit), so the
+conversation loop never waits on the disk. The log is deleted once the
+session is saved; a log that is still there on the next launch belongs to an
+unfinished session and can be resumed or finalized.
+
+When an encrypted store is in use, every line is sealed with the store key.
+"""
+import os
+import json
+import uuid
+import datetime
+import threading
+from pathlib import Path
+
+DEFAULT_LOG_DIR = "sessions"
+
+
+def _log_dir():
+    return Path(os.getenv('SESSION_LOG_DIR', DEFAULT_LOG_DIR))
+
+
+class TurnLog:
+    def __init__(self, path, store=None, sync_interval=1.0):
+        self.path = Path(path)
+        self.store = store
+        self.sync_interval = sync_interval
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=64 * 1024)
+        self._lock = threading.Lock()  # Guards the buffered file for appenders
+        self._sync_lock = threading.Lock()  # One sync at a time; close waits for it
+        self._dirty = False
+        self._closed = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sync_loop, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def start(cls, app, store=None, **kwargs):
+        """Create the log for a new session"""
+        log_dir = _log_dir()
+        log_dir.mkdir(parents=True, exist_ok=True)
+        log = cls(log_dir / f"{app}_{uuid.uuid4().hex[:12]}.wal", store, **kwargs)
+        log.append({"type": "session", "app": app, "started": datetime.datetime.now().isoformat()})
+        return log
+
+    @classmethod
+    def resume(cls, path, header, items, store=None, **kwargs):
+        """Rewrite a recovered log without any torn tail and keep appending to it"""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        log = cls(tmp_path, store, **kwargs)
+        log.append(header)
+        for item in items:
+            log.append_item(item)
+        log.close()
+        os.replace(tmp_path, path)
+        return cls(path, store, **kwargs)
+
+    def _encode(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        if self.store is not None:
+            line = self.store.seal_text(line, b"turn-log")
+        return line + "\n"
+
+    def append(self, record):
+        """Queue a record; it reaches the disk on the next group sync"""
+        with self._lock:
+            self._file.write(self._encode(record))
+            self._dirty = True
+
+    def append_item(self, item):
+        self.append({"type": "item", "item": item})
+
+    def sync(self):
+        """Flush the buffer under the lock, then fsync without blocking appends"""
+        with self._sync_lock:
+            with self._lock:
+                if not self._dirty or self._closed:
+                    return
+                self._file.flush()
+                self._dirty = False
+                fd = self._file.fileno()
+            os.fsync(fd)
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def close(self):
+        """Flush everything and stop the sync thread (the log stays on disk)"""
+        if self._closed:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.sync()
+        with self._sync_lock, self._lock:
+            self._closed = True
+            self._file.close()
+
+    def discard(self):
+        """Close and delete the log once the session has been saved"""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def read_log(path, store=None):
+    """Return (session header, conversation items) from a log.
+
+    A torn last line (crash mid-write) is ignored.
+    """
+    header, items = {}, []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                if store is not None:
+                    line = store.open_text(line, b"turn-log")
+                record = json.loads(line)
+            except Exception:
+                break
+            if record.get("type") == "session":
+                header = record
+            elif record.get("type") == "item":
+                items.append(record["item"])
+    return header, items
+
+
+def find_unfinished(app):
+    """Logs left behind by sessions of `app` that never got saved, oldest first"""
+    log_dir = _log_dir()
+    if not log_dir.exists():
+        return []
+    return sorted(log_dir.glob(f"{app}_*.wal"), key=lambda p: p.stat().st_mtime)
+
+
+def recover_session(diary, app):
+    """Offer to resume or finalize an unfinished session on startup.
+
+    `diary` is a voice diary instance with conversation_data, session_date,
+    generate_diary_entry() and save_conversation(). Returns the TurnLog to
+    keep appending to when a session is resumed, otherwise None.
+    """
+    store = diary.store
+    for path in find_unfinished(app):
+        try:
+            header, items = read_log(path, store)
+        except Exception as e:
+            print(f"Could not read session log {path.name}: {e}")
+            continue
+        if not items:
+            path.unlink(missing_ok=True)
+            continue
+
+        started = header.get("started", "")[:16].replace("T", " ")
+        print(f"\n*** Found an unfinished session from {started} ({len(items)} messages) ***")
+        choice = input("Resume it (r), finalize it into a diary entry now (f), or discard it (d)? ").strip().lower()
+
+        if choice == 'r':
+            diary.conversation_data.clear()
+            diary.conversation_data.extend(items)
+            diary.session_date = header.get("started", "")[:10] or None
+            return TurnLog.resume(path, header, items, store)
+        elif choice == 'f':
+            if not diary.check_api_limit():
+                print("Keeping the session log so it can be finalized later.")
+                continue
+            diary.conversation_data.clear()
+            diary.conversation_data.extend(items)
+            diary.session_date = header.get("started", "")[:10] or None
+            diary_entry = diary.generate_diary_entry()
+            print(f"\n{diary_entry}")
+            diary.save_conversation(diary_entry)
+            path.unlink(missing_ok=True)
+            diary.conversation_data.clear()
+            diary.session_date = None
+        elif choice == 'd':
+            path.unlink(missing_ok=True)
+    return None
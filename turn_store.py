@@ -0,0 +1,256 @@
+"""Compact, memory-bounded storage for conversation turns.
+
+A list of turn dicts repeats every key, keeps an ISO timestamp string per
+turn and grows without limit. TurnStore keeps turns in columns instead:
+
+- message text as one UTF-8 byte stream plus an offset per turn,
+- timestamps as integer microseconds since 1970-01-01 (naive, like the
+  `datetime.now().isoformat()` values the apps write),
+- speaker and emotion labels as small ints into an interned tag table,
+- audio archive hashes as raw digest bytes in a sparse table,
+- anything else (unusual fields) in a sparse side table.
+
+Once the in-memory text passes `spill_bytes` it is moved to a temporary
+file in blocks (sealed with the store key when an encrypted store is in
+use), so a marathon session keeps roughly 30 bytes per turn in memory plus
+the unspilled tail. Turns are read back as the same dicts the apps built.
+"""
+import os
+import sys
+import bisect
+import datetime
+import tempfile
+import threading
+from array import array
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_SPILL_KB = 512
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+NO_EMOTION_KEY = -2  # Item had no "emotion" key at all (AI turns)
+EMOTION_NONE = -1    # "emotion": None
+NO_TIMESTAMP = -(2 ** 63)  # Item had no "timestamp" key
+
+# Transcript line formats used by the apps' summary prompts
+VOICE_TRANSCRIPT = {"user": "I said: {message}\n", "ai": "The AI asked: {message}\n"}
+SIMPLE_TRANSCRIPT = {"user": "I said: {message}\n", "ai": "AI asked: {message}\n"}
+QA_TRANSCRIPT = {"ai": "Q: {message}\n", "user": "A: {message}\n\n"}
+
+
+def _spill_threshold():
+    return int(os.getenv('TURN_STORE_SPILL_KB', DEFAULT_SPILL_KB)) * 1024
+
+
+class TurnStore:
+    def __init__(self, items=(), spill_bytes=None, store=None):
+        self.spill_bytes = _spill_threshold() if spill_bytes is None else spill_bytes
+        self.store = store
+        self._lock = threading.RLock()
+        self._spill_file = None
+        self._reset()
+        self.extend(items)
+
+    def _reset(self):
+        self._tags = []
+        self._tag_ids = {}
+        self._offsets = array('Q', [0])  # Start of each message in the text stream, plus the end
+        self._timestamps = array('q')
+        self._speakers = array('H')
+        self._emotions = array('h')
+        self._intensities = array('d')
+        self._audio = {}  # turn index -> archive digest bytes
+        self._extras = {}  # turn index -> {key: value} for fields without a column
+        self._text = bytearray()  # Unspilled tail of the text stream
+        self._spilled = 0  # Bytes of the text stream that live in the spill file
+        self._block_starts = array('Q')  # Stream offset of each spilled block
+        self._block_positions = array('Q')  # File position and size of each block
+        self._block_sizes = array('Q')
+        self._cached_block = (None, b"")
+
+    def _tag(self, value):
+        tag = self._tag_ids.get(value)
+        if tag is None:
+            tag = self._tag_ids[value] = len(self._tags)
+            self._tags.append(sys.intern(value))
+        return tag
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, item):
+        """Add one turn dict (the dict itself is not kept)"""
+        with self._lock:
+            self._append(dict(item))
+
+    def _append(self, item):
+        speaker = self._tag(item.pop("speaker"))
+        message = item.pop("message").encode("utf-8")
+
+        if "timestamp" not in item:
+            micros = NO_TIMESTAMP
+        else:
+            timestamp = item.pop("timestamp")
+            try:
+                parsed = datetime.datetime.fromisoformat(timestamp)
+                if parsed.tzinfo is not None:
+                    raise ValueError
+                micros = (parsed - EPOCH) // ONE_MICROSECOND
+            except (TypeError, ValueError):
+                micros = 0
+                item["timestamp"] = timestamp
+
+        emotion, intensity = NO_EMOTION_KEY, 0.0
+        if "emotion" in item:
+            value = item.pop("emotion")
+            if value is None:
+                emotion = EMOTION_NONE
+            elif isinstance(value, dict) and set(value) == {"dominant", "intensity"} and isinstance(value["dominant"], str):
+                emotion, intensity = self._tag(value["dominant"]), float(value["intensity"])
+            else:
+                item["emotion"] = value
+
+        index = len(self)
+        audio = item.get("audio")
+        if isinstance(audio, str) and len(audio) == 64:
+            try:
+                self._audio[index] = bytes.fromhex(item.pop("audio"))
+            except ValueError:
+                item["audio"] = audio
+        self._text += message
+        self._offsets.append(self._spilled + len(self._text))
+        self._speakers.append(speaker)
+        self._emotions.append(emotion)
+        self._intensities.append(intensity)
+        if item:
+            self._extras[index] = item
+        self._timestamps.append(micros)  # Last, so len() only counts complete turns
+        if len(self._text) >= self.spill_bytes:
+            self._spill()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def clear(self):
+        with self._lock:
+            self.close()
+            self._reset()
+
+    def _spill(self):
+        """Move the in-memory text tail to the spill file as one block"""
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="turns_")
+        block = bytes(self._text)
+        if self.store is not None:
+            block = self.store.seal_text(block.decode("utf-8"), b"turn-store").encode("ascii")
+        self._spill_file.seek(0, os.SEEK_END)
+        self._block_starts.append(self._spilled)
+        self._block_positions.append(self._spill_file.tell())
+        self._block_sizes.append(len(block))
+        self._spill_file.write(block)
+        self._spilled += len(self._text)
+        self._text = bytearray()
+
+    def _read_block(self, block):
+        if self._cached_block[0] != block:
+            self._spill_file.seek(self._block_positions[block])
+            data = self._spill_file.read(self._block_sizes[block])
+            if self.store is not None:
+                data = self.store.open_text(data.decode("ascii"), b"turn-store").encode("utf-8")
+            self._cached_block = (block, data)
+        return self._cached_block[1]
+
+    def _message(self, index):
+        start, end = self._offsets[index], self._offsets[index + 1]
+        if start >= self._spilled:
+            return self._text[start - self._spilled:end - self._spilled].decode("utf-8")
+        block = bisect.bisect_right(self._block_starts, start) - 1
+        base = self._block_starts[block]
+        return self._read_block(block)[start - base:end - base].decode("utf-8")
+
+    def _item(self, index):
+        item = {
+            "speaker": self._tags[self._speakers[index]],
+            "message": self._message(index),
+        }
+        if self._timestamps[index] != NO_TIMESTAMP:
+            item["timestamp"] = (EPOCH + self._timestamps[index] * ONE_MICROSECOND).isoformat()
+        emotion = self._emotions[index]
+        if emotion == EMOTION_NONE:
+            item["emotion"] = None
+        elif emotion >= 0:
+            item["emotion"] = {"dominant": self._tags[emotion], "intensity": self._intensities[index]}
+        audio = self._audio.get(index)
+        if audio is not None:
+            item["audio"] = audio.hex()
+        item.update(self._extras.get(index, ()))
+        return item
+
+    def __getitem__(self, key):
+        with self._lock:
+            if isinstance(key, slice):
+                return [self._item(i) for i in range(*key.indices(len(self)))]
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("turn index out of range")
+            return self._item(key)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            with self._lock:
+                yield self._item(index)
+
+    def messages(self, speaker=None):
+        """Yield message texts (optionally of one speaker) without building dicts"""
+        tag = self._tag_ids.get(speaker) if speaker is not None else None
+        for index in range(len(self)):
+            if speaker is None or self._speakers[index] == tag:
+                with self._lock:
+                    yield self._message(index)
+
+    def iter_transcript(self, line_formats):
+        """Yield the transcript in chunks, e.g. {"user": "I said: {message}\\n", ...}.
+
+        Works through the text one spilled block (or the in-memory tail) at
+        a time, so each block is read and decrypted once and yields one chunk.
+        """
+        index = 0
+        while True:
+            with self._lock:
+                count = len(self)
+                if index >= count:
+                    return
+                start = self._offsets[index]
+                if start < self._spilled:
+                    block = bisect.bisect_right(self._block_starts, start) - 1
+                    data, base = self._read_block(block), self._block_starts[block]
+                else:
+                    data, base = self._text, self._spilled
+                end = base + len(data)
+                formats = [line_formats.get(tag, "").partition("{message}") for tag in self._tags]
+                offsets, speakers, lines = self._offsets, self._speakers, []
+                while index < count and offsets[index] < end:
+                    prefix, found, suffix = formats[speakers[index]]
+                    if found:
+                        lines.append(prefix + data[offsets[index] - base:offsets[index + 1] - base].decode("utf-8") + suffix)
+                    index += 1
+            yield "".join(lines)
+
+    def transcript(self, line_formats):
+        """The whole conversation as one string"""
+        return "".join(self.iter_transcript(line_formats))
+
+    @property
+    def spilled_bytes(self):
+        return self._spilled
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
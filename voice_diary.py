@@ -1,24 +1,71 @@
 import os
+import sys
 import json
 import datetime
 import time
 import io
 import tempfile
+import threading
 from pathlib import Path
 import pyaudio
 import keyboard
 import numpy as np
 from openai import OpenAI
+from audio_utils import AudioBuffer, prepare_for_upload, UPLOAD_RATE
 from dotenv import load_dotenv
+from diary_store import open_store_from_env
+from audio_archive import open_archive_from_env
+from turn_log import TurnLog, recover_session
+from batch_summaries import deferred_enabled, enqueue_summary, new_job_id, PENDING_SUMMARY
+from request_layer import RequestLayer, DEFAULT_MEMO_TTL
+from duplex_audio import MicListener, InterruptiblePlayer
+from languages import SessionLanguage
+from turn_store import TurnStore, VOICE_TRANSCRIPT
 
 load_dotenv()
 
+# Static prefix of every conversation request, kept identical so provider-side prompt caching applies
+CONVERSATION_PROMPT = """You are a supportive friend helping someone reflect on their day through a voice diary. 
+                    
+                    Guidelines:
+                    - Be warm, empathetic, and encouraging
+                    - Ask thoughtful follow-up questions to help them express emotions
+                    - Guide conversation naturally without being pushy
+                    - Help them explore their feelings and daily experiences
+                    - Keep responses conversational and under 50 words
+                    - At the end, also provide a brief emotion analysis in this format: EMOTION_ANALYSIS: [dominant_emotion] [intensity_0_to_1]
+                    
+                    Example: "That sounds really challenging. How did that make you feel in the moment? EMOTION_ANALYSIS: frustrated 0.7" """
+SUMMARY_PROMPT = """Create a personal diary entry in first-person narrative style from this conversation. 
+                        
+                        Requirements:
+                        - Write as if the user is personally writing their diary
+                        - Include emotional highlights and key events
+                        - Use 'I' statements throughout
+                        - Keep it natural and reflective
+                        - Write as one cohesive paragraph
+                        - Capture the essence of their day and feelings"""
+
+GREETING = "Hi! I'm here to help you reflect on your day. How are you feeling right now?"
+
 class VoiceDiary:
-    def __init__(self):
+    def __init__(self, full_duplex=False):
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self.conversation_data = []
+        self.requests = RequestLayer(self.client)
         self.api_usage_count = 0
         self.max_api_calls = 100  # Budget control
+        self.session_date = None  # Set when finishing a recovered session
+        self.turn_log = None
+        self.language = SessionLanguage()  # Detected from the first transcription unless DIARY_LANGUAGE is set
+        
+        # Full-duplex (barge-in) mode state
+        self.full_duplex = full_duplex
+        self.player = None
+        self.barge_in_latencies = []
+        self._barge_in_at = None  # detected_at of a barge-in whose playback hasn't stopped yet
+        self._current_turn = None  # (cancel event, worker thread)
+        self._conversation_lock = threading.Lock()
+        self._duplex_stop = threading.Event()
         
         # Audio settings
         self.CHUNK = 1024
@@ -27,14 +74,26 @@ class VoiceDiary:
         self.RATE = 44100
         self.SILENCE_THRESHOLD = 500
         self.SILENCE_DURATION = 2.0
+        self.UPLOAD_RATE = UPLOAD_RATE  # Resampled before sending to Whisper
+        self.NORMALIZE_AUDIO = True
+        
+        # Encrypted storage when DIARY_PASSPHRASE is set
+        self.store = open_store_from_env()
+        # Keeps utterance audio for re-transcription when AUDIO_ARCHIVE_DIR is set
+        self.archive = open_archive_from_env(self.store)
+        # Compact turn storage that spills to disk in long sessions
+        self.conversation_data = TurnStore(store=self.store)
         
         # Initialize PyAudio
         self.audio = pyaudio.PyAudio()
         
         print("*** Voice AI Diary Initialized ***")
         print("Controls:")
-        print("- Hold SPACEBAR to record voice")
-        print("- Release SPACEBAR to stop recording")
+        if self.full_duplex:
+            print("- Just speak; talking over the AI interrupts it (headphones recommended)")
+        else:
+            print("- Hold SPACEBAR to record voice")
+            print("- Release SPACEBAR to stop recording")
         print("- Press 'q' to end conversation and generate diary")
         print("- Press 'Ctrl+C' to exit without saving")
     
@@ -46,11 +105,22 @@ class VoiceDiary:
             return False
         return True
     
+    def _spend_api_call(self):
+        """Budget check for a call made on the app's behalf (counts it if allowed)"""
+        if not self.check_api_limit():
+            return False
+        self.api_usage_count += 1
+        return True
+    
+    def localize(self, text):
+        """A fixed text in the session language (the translation call is budgeted)"""
+        return self.language.localize(self.requests, [text], allow_call=self._spend_api_call)[0]
+    
     def record_audio(self):
         """Record audio while spacebar is held"""
         print("\\n*** Hold SPACEBAR and speak...")
         
-        frames = []
+        frames = AudioBuffer(self.RATE)
         stream = self.audio.open(
             format=self.FORMAT,
             channels=self.CHANNELS,
@@ -75,15 +145,14 @@ class VoiceDiary:
         stream.stop_stream()
         stream.close()
         
-        if not frames:
+        if not len(frames):
             return None
         
-        # Convert to audio file
-        audio_data = b''.join(frames)
-        return audio_data
+        # prepare_for_upload reads the blocks directly, no contiguous copy needed
+        return frames
     
-    def transcribe_audio(self, audio_data, retry_count=0):
-        """Convert audio to text using Whisper"""
+    def transcribe_audio(self, upload_data, retry_count=0):
+        """Convert 16 kHz audio (see prepare_for_upload) to text using Whisper"""
         if not self.check_api_limit():
             return None
             
@@ -98,8 +167,8 @@ class VoiceDiary:
             wav_file = wave.open(temp_path, 'wb')
             wav_file.setnchannels(self.CHANNELS)
             wav_file.setsampwidth(self.audio.get_sample_size(self.FORMAT))
-            wav_file.setframerate(self.RATE)
-            wav_file.writeframes(audio_data)
+            wav_file.setframerate(self.UPLOAD_RATE)
+            wav_file.writeframes(upload_data.tobytes())
             wav_file.close()
             
             # Small delay to ensure file is fully written
@@ -110,10 +179,11 @@ class VoiceDiary:
                 response = self.client.audio.transcriptions.create(
                     model="whisper-1",
                     file=audio_file,
-                    language="en"
+                    **self.language.transcription_options()
                 )
                 
             self.api_usage_count += 1
+            self.language.observe_transcription(response)
             
             # Clean up temp file with retry
             try:
@@ -133,34 +203,36 @@ class VoiceDiary:
             if retry_count < 1:
                 print("Retrying transcription...")
                 time.sleep(1)  # Wait before retry
-                return self.transcribe_audio(audio_data, retry_count + 1)
+                return self.transcribe_audio(upload_data, retry_count + 1)
+            elif self.full_duplex:
+                print("STT failed twice. Please say that again.")
+                return None  # No keyboard prompt while the mic thread is running
             else:
                 print("STT failed twice. Falling back to text input.")
                 return input("Type your message: ").strip()
     
-    def get_ai_response(self, user_message, conversation_history):
-        """Get AI response using GPT-4o-mini"""
+    def archive_audio(self, upload_data):
+        """Store the utterance in the audio archive (if enabled) and return its hash"""
+        if self.archive is None:
+            return None
+        try:
+            return self.archive.add(upload_data, self.UPLOAD_RATE)
+        except Exception as e:
+            print(f"Archive Error: {str(e)}")
+            return None
+    
+    def get_ai_response(self, user_message, conversation_history, cancel=None):
+        """Get AI response using GPT-4o-mini.
+
+        With `cancel` (full-duplex turns) the reply is streamed and abandoned
+        as soon as it is set, returning (None, None).
+        """
         if not self.check_api_limit():
             return None, None
             
         try:
             # Build conversation context
-            messages = [
-                {
-                    "role": "system",
-                    "content": """You are a supportive friend helping someone reflect on their day through a voice diary. 
-                    
-                    Guidelines:
-                    - Be warm, empathetic, and encouraging
-                    - Ask thoughtful follow-up questions to help them express emotions
-                    - Guide conversation naturally without being pushy
-                    - Help them explore their feelings and daily experiences
-                    - Keep responses conversational and under 50 words
-                    - At the end, also provide a brief emotion analysis in this format: EMOTION_ANALYSIS: [dominant_emotion] [intensity_0_to_1]
-                    
-                    Example: "That sounds really challenging. How did that make you feel in the moment? EMOTION_ANALYSIS: frustrated 0.7" """
-                }
-            ]
+            messages = self.language.system_messages(CONVERSATION_PROMPT)
             
             # Add conversation history
             for item in conversation_history[-6:]:  # Last 6 messages for context
@@ -172,15 +244,23 @@ class VoiceDiary:
             # Add current user message
             messages.append({"role": "user", "content": user_message})
             
-            response = self.client.chat.completions.create(
+            request = dict(
                 model="gpt-4o-mini",
                 messages=messages,
                 max_tokens=100,
                 temperature=0.7
             )
-            
-            self.api_usage_count += 1
-            ai_response = response.choices[0].message.content.strip()
+            if cancel is not None:
+                self.api_usage_count += 1
+                ai_response = self.requests.stream(request, cancel)
+                if ai_response is None:
+                    return None, None
+            else:
+                response, reused = self.requests.chat(request, memo_ttl=DEFAULT_MEMO_TTL)
+                if not reused:
+                    self.api_usage_count += 1
+                ai_response = response.choices[0].message.content
+            ai_response = ai_response.strip()
             
             # Extract emotion analysis
             emotion_analysis = None
@@ -208,7 +288,7 @@ class VoiceDiary:
         try:
             response = self.client.audio.speech.create(
                 model="tts-1",
-                voice="nova",
+                voice=self.language.voice,
                 input=text,
                 speed=1.0
             )
@@ -267,46 +347,50 @@ class VoiceDiary:
             return "Cannot generate diary due to API limit."
         
         try:
-            # Prepare conversation text
-            conversation_text = ""
-            for item in self.conversation_data:
-                speaker = "I said" if item["speaker"] == "user" else "The AI asked"
-                conversation_text += f"{speaker}: {item['message']}\\n"
+            response, reused = self.requests.chat(self.summary_request())
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """Create a personal diary entry in first-person narrative style from this conversation. 
-                        
-                        Requirements:
-                        - Write as if the user is personally writing their diary
-                        - Include emotional highlights and key events
-                        - Use 'I' statements throughout
-                        - Keep it natural and reflective
-                        - Write as one cohesive paragraph
-                        - Capture the essence of their day and feelings"""
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Create a diary entry from this conversation:\\n\\n{conversation_text}"
-                    }
-                ],
-                max_tokens=300,
-                temperature=0.7
-            )
-            
-            self.api_usage_count += 1
+            if not reused:
+                self.api_usage_count += 1
             return response.choices[0].message.content.strip()
             
         except Exception as e:
             print(f"Diary Generation Error: {str(e)}")
             return "Could not generate diary entry due to an error."
     
-    def save_conversation(self, diary_entry):
-        """Save conversation and diary to JSON file"""
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+    def summary_request(self):
+        """Chat completion arguments for the diary summary (used directly or batched)"""
+        if not self.language.resolved:  # e.g. finalizing a recovered session
+            self.language.observe_text(" ".join(self.conversation_data.messages("user")))
+        
+        # Prepare conversation text
+        conversation_text = self.conversation_data.transcript(VOICE_TRANSCRIPT)
+        
+        return dict(
+            model="gpt-4o-mini",
+            messages=self.language.system_messages(SUMMARY_PROMPT) + [
+                {
+                    "role": "user",
+                    "content": f"Create a diary entry from this conversation:\\n\\n{conversation_text}"
+                }
+            ],
+            max_tokens=300,
+            temperature=0.7
+        )
+    
+    def queue_diary_entry(self):
+        """Save now with a pending summary and queue the summary for the next batch"""
+        job_id = new_job_id()
+        filename = self.save_conversation(PENDING_SUMMARY, summary_job=job_id)
+        enqueue_summary(job_id, self.summary_request(), {
+            "type": "day_file",
+            "path": os.path.abspath(filename),
+            "key": "summary"
+        })
+        print("*** Your diary entry will be written by the next summary batch (python batch_summaries.py run) ***")
+    
+    def save_conversation(self, diary_entry, summary_job=None):
+        """Save conversation and diary to JSON file; returns the file name"""
+        today = self.session_date or datetime.datetime.now().strftime("%Y-%m-%d")
         filename = f"voice_diary_{today}.json"
         
         # Calculate overall emotion analysis
@@ -328,24 +412,33 @@ class VoiceDiary:
         
         data = {
             "date": today,
-            "conversation": self.conversation_data,
+            "conversation": list(self.conversation_data),
             "summary": diary_entry,
             "emotion_analysis": {
                 "dominant": dominant_emotion,
                 "intensity": round(avg_intensity, 2)
             },
-            "api_usage": self.api_usage_count
+            "api_usage": self.api_usage_count,
+            "language": self.language.effective
         }
+        if summary_job:
+            data["summary_job"] = summary_job
+        
+        if self.store is not None:
+            record_id = self.store.append("voice_session", today, data)
+            print(f"\\n*** Conversation saved to encrypted store (record {record_id}) ***")
+            return
         
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         
         print(f"\\n*** Conversation saved to {filename} ***")
+        return filename
     
     def start_conversation(self):
         """Main conversation loop"""
         print("\\n*** Starting Voice Diary Session ***")
-        self.speak_text("Hi! I'm here to help you reflect on your day. How are you feeling right now?")
+        self.speak_text(self.localize(GREETING))
         
         while True:
             try:
@@ -356,14 +449,19 @@ class VoiceDiary:
                 
                 # Record user input
                 audio_data = self.record_audio()
-                if not audio_data:
+                if audio_data is None:
                     continue
                 
+                # Downsample to 16 kHz before upload (~3x smaller file)
+                upload_data = prepare_for_upload(audio_data, self.RATE, self.UPLOAD_RATE, self.NORMALIZE_AUDIO)
+                
                 # Transcribe audio
-                user_text = self.transcribe_audio(audio_data)
+                user_text = self.transcribe_audio(upload_data)
                 if not user_text:
                     continue
                 
+                audio_ref = self.archive_audio(upload_data)
+                
                 print(f"You: {user_text}")
                 
                 # Get AI response
@@ -372,18 +470,25 @@ class VoiceDiary:
                     break
                 
                 # Store conversation
-                self.conversation_data.append({
+                user_item = {
                     "speaker": "user",
                     "message": user_text,
                     "timestamp": datetime.datetime.now().isoformat(),
                     "emotion": emotion
-                })
-                
-                self.conversation_data.append({
+                }
+                if audio_ref:
+                    user_item["audio"] = audio_ref
+                ai_item = {
                     "speaker": "ai",
                     "message": ai_response,
                     "timestamp": datetime.datetime.now().isoformat()
-                })
+                }
+                self.conversation_data.append(user_item)
+                self.conversation_data.append(ai_item)
+                
+                # Write-ahead so a crash or Ctrl+C doesn't lose the session
+                self.turn_log.append_item(user_item)
+                self.turn_log.append_item(ai_item)
                 
                 print(f"AI: {ai_response}")
                 
@@ -398,12 +503,181 @@ class VoiceDiary:
         
         return True
     
+    def speak_text_interruptible(self, text, cancel):
+        """Stream TTS and play it, stopping as soon as `cancel` is set"""
+        if not self.check_api_limit():
+            return
+        
+        import uuid
+        import platform
+        temp_path = os.path.join(tempfile.gettempdir(), f"voice_diary_tts_{uuid.uuid4().hex}.mp3")
+        
+        try:
+            with self.client.audio.speech.with_streaming_response.create(
+                model="tts-1",
+                voice=self.language.voice,
+                input=text,
+                speed=1.0
+            ) as response:
+                self.api_usage_count += 1
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_bytes(4096):
+                        if cancel.is_set():
+                            return  # Leaving the block closes the HTTP stream
+                        f.write(chunk)
+            
+            if platform.system() == "Windows":
+                print("(Audio playback disabled on Windows due to file access issues)")
+                return
+            self.player.play(temp_path, cancel)
+            
+        except Exception as e:
+            print(f"TTS Error: {str(e)}")
+        
+        finally:
+            try:
+                os.unlink(temp_path)
+            except:
+                pass
+    
+    def _record_items(self, *items):
+        with self._conversation_lock:
+            for item in items:
+                self.conversation_data.append(item)
+                self.turn_log.append_item(item)
+    
+    def _process_turn(self, audio_data, cancel):
+        """Transcribe, answer and speak one utterance, dropping out once cancelled"""
+        upload_data = prepare_for_upload(audio_data, self.RATE, self.UPLOAD_RATE, self.NORMALIZE_AUDIO)
+        user_text = self.transcribe_audio(upload_data)
+        if not user_text:
+            return
+        
+        audio_ref = self.archive_audio(upload_data)
+        print(f"You: {user_text}")
+        
+        user_item = {
+            "speaker": "user",
+            "message": user_text,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "emotion": None
+        }
+        if audio_ref:
+            user_item["audio"] = audio_ref
+        
+        if cancel.is_set():
+            # The user kept talking; keep what they said and answer the next utterance instead
+            self._record_items(user_item)
+            return
+        
+        ai_response, emotion = self.get_ai_response(user_text, self.conversation_data, cancel)
+        if cancel.is_set():
+            user_item["emotion"] = emotion
+            self._record_items(user_item)  # Barged in while the reply was streaming, drop it
+            return
+        if not ai_response:
+            self._record_items(user_item)
+            self._duplex_stop.set()  # API budget reached
+            return
+        
+        user_item["emotion"] = emotion
+        
+        ai_item = {
+            "speaker": "ai",
+            "message": ai_response,
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        self._record_items(user_item, ai_item)
+        
+        print(f"AI: {ai_response}")
+        self.speak_text_interruptible(ai_response, cancel)
+    
+    def _start_turn(self, work):
+        """Run `work(cancel)` on a worker thread, cancelling any turn still running"""
+        if self._current_turn is not None:
+            self._current_turn[0].set()
+        self._barge_in_at = None
+        cancel = threading.Event()
+        worker = threading.Thread(target=work, args=(cancel,), daemon=True)
+        self._current_turn = (cancel, worker)
+        worker.start()
+    
+    def _on_speech_start(self, detected_at):
+        """Barge-in: called from the mic thread the moment the user starts talking"""
+        turn = self._current_turn
+        if turn is None or turn[0].is_set() or not turn[1].is_alive():
+            return
+        self._barge_in_at = detected_at
+        turn[0].set()
+        if self.player is not None:
+            self.player.stop(wait=False)  # The turn's worker waits for the player to exit
+        print("*** Interrupted - listening ***")
+    
+    def _on_playback_interrupted(self, stopped_at):
+        """Called by the player once cancelled playback has really stopped"""
+        detected_at, self._barge_in_at = self._barge_in_at, None
+        if detected_at is None:
+            return  # Cancelled by a new turn or the end of the session, not by speech
+        latency = stopped_at - detected_at
+        self.barge_in_latencies.append(latency)
+        print(f"*** Playback stopped {latency * 1000:.0f} ms after you started talking ***")
+    
+    def start_duplex_conversation(self):
+        """Full-duplex loop: the mic stays live and speaking cancels the AI's turn"""
+        print("\\n*** Starting Voice Diary Session (full duplex) ***")
+        listener = MicListener(
+            self.audio, self.RATE, self.CHUNK, self.FORMAT, self.CHANNELS,
+            threshold=self.SILENCE_THRESHOLD,
+            silence_duration=self.SILENCE_DURATION,
+            on_speech_start=self._on_speech_start
+        )
+        self.player = InterruptiblePlayer(listener.playback_active, on_interrupted=self._on_playback_interrupted)
+        listener.start()
+        
+        try:
+            greeting = self.localize(GREETING)
+            self._start_turn(lambda cancel: self.speak_text_interruptible(greeting, cancel))
+            
+            while not self._duplex_stop.is_set():
+                # Check for quit command
+                if keyboard.is_pressed('q'):
+                    print("\\n*** Ending conversation... ***")
+                    break
+                
+                audio_data = listener.next_utterance(timeout=0.1)
+                if audio_data is not None:
+                    self._start_turn(lambda cancel, audio_data=audio_data: self._process_turn(audio_data, cancel))
+            
+            return True
+        
+        except KeyboardInterrupt:
+            print("\\n*** Session interrupted ***")
+            return None
+        
+        finally:
+            if self._current_turn is not None:
+                self._current_turn[0].set()
+                self.player.stop()
+                self._current_turn[1].join(timeout=2.0)
+            listener.stop()
+    
     def run(self):
         """Main application loop"""
         try:
-            conversation_completed = self.start_conversation()
+            self.turn_log = recover_session(self, "voice_diary") or TurnLog.start("voice_diary", self.store)
+            if self.full_duplex:
+                conversation_completed = self.start_duplex_conversation()
+            else:
+                conversation_completed = self.start_conversation()
+            
+            if self.conversation_data and (not conversation_completed or not self.check_api_limit()):
+                print("*** Session kept. You can resume or finalize it next time you start the app. ***")
+            
+            elif conversation_completed and self.conversation_data and deferred_enabled() and self.store is None:
+                self.queue_diary_entry()
+                self.turn_log.discard()
             
-            if conversation_completed and self.conversation_data:
+            elif conversation_completed and self.conversation_data:
                 print("\\n*** Generating your diary entry... ***")
                 diary_entry = self.generate_diary_entry()
                 
@@ -416,20 +690,30 @@ class VoiceDiary:
                 print("="*50)
                 
                 self.save_conversation(diary_entry)
+                self.turn_log.discard()
                 print(f"*** API Usage: {self.api_usage_count} calls ***")
+                for line in self.requests.report():
+                    print(line)
+                if self.barge_in_latencies:
+                    latencies = sorted(self.barge_in_latencies)
+                    print(f"Barge-ins: {len(latencies)}, cancel-to-listen "
+                          f"median {latencies[len(latencies) // 2] * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
                 
             else:
+                self.turn_log.discard()
                 print("No diary entry created.")
                 
         except Exception as e:
             print(f"Application Error: {str(e)}")
         
         finally:
+            if self.turn_log is not None:
+                self.turn_log.close()
             self.audio.terminate()
 
 if __name__ == "__main__":
     try:
-        diary = VoiceDiary()
+        diary = VoiceDiary(full_duplex="--duplex" in sys.argv)
         diary.run()
     except KeyboardInterrupt:
         print("\\n*** Voice Diary App Closed ***")
\ No newline at end of file
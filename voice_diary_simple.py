@@ -10,22 +10,46 @@ import pyaudio
 import wave
 import numpy as np
 from openai import OpenAI
+from audio_utils import AudioBuffer, prepare_for_upload
 from dotenv import load_dotenv
+from diary_store import open_store_from_env
+from audio_archive import open_archive_from_env
+from turn_log import TurnLog, recover_session
+from batch_summaries import deferred_enabled, enqueue_summary, new_job_id, PENDING_SUMMARY
+from request_layer import RequestLayer, DEFAULT_MEMO_TTL
+from languages import SessionLanguage
+from turn_store import TurnStore, SIMPLE_TRANSCRIPT
 
 load_dotenv()
 
+# Static prefix of every conversation request, kept identical so provider-side prompt caching applies
+CONVERSATION_PROMPT = """You are a supportive friend helping someone with their voice diary. Be warm, empathetic, and ask thoughtful follow-up questions. Keep responses under 50 words. At the end, include emotion analysis: EMOTION_ANALYSIS: [emotion] [0.0-1.0]"""
+SUMMARY_PROMPT = "Create a first-person diary entry from this conversation. Write as if the user is personally writing their diary. Include emotions and key events. Use 'I' statements throughout."
+GREETING = "Hi! I'm here to help you reflect on your day. How are you feeling?"
+
 class SimpleVoiceDiary:
     def __init__(self):
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self.conversation_data = []
+        self.requests = RequestLayer(self.client)
         self.api_usage_count = 0
         self.max_api_calls = 50  # Reduced for testing
+        self.session_date = None  # Set when finishing a recovered session
+        self.turn_log = None
+        self.language = SessionLanguage()  # Detected from the first transcription unless DIARY_LANGUAGE is set
         
         # Audio settings
         self.CHUNK = 1024
         self.FORMAT = pyaudio.paInt16
         self.CHANNELS = 1
         self.RATE = 16000  # Reduced for better compatibility
+        self.NORMALIZE_AUDIO = True
+        
+        # Encrypted storage when DIARY_PASSPHRASE is set
+        self.store = open_store_from_env()
+        # Keeps utterance audio for re-transcription when AUDIO_ARCHIVE_DIR is set
+        self.archive = open_archive_from_env(self.store)
+        # Compact turn storage that spills to disk in long sessions
+        self.conversation_data = TurnStore(store=self.store)
         
         # Initialize PyAudio
         self.audio = pyaudio.PyAudio()
@@ -42,13 +66,24 @@ class SimpleVoiceDiary:
             return False
         return True
     
+    def _spend_api_call(self):
+        """Budget check for a call made on the app's behalf (counts it if allowed)"""
+        if not self.check_api_limit():
+            return False
+        self.api_usage_count += 1
+        return True
+    
+    def localize(self, text):
+        """A fixed text in the session language (the translation call is budgeted)"""
+        return self.language.localize(self.requests, [text], allow_call=self._spend_api_call)[0]
+    
     def record_audio_simple(self):
         """Simple audio recording with ENTER key"""
         input("\\nPress ENTER to start recording...")
         
         print("*** RECORDING... Press ENTER to stop ***")
         
-        frames = []
+        frames = AudioBuffer(self.RATE)
         stream = self.audio.open(
             format=self.FORMAT,
             channels=self.CHANNELS,
@@ -84,13 +119,14 @@ class SimpleVoiceDiary:
         stream.stop_stream()
         stream.close()
         
-        if not frames:
+        if not len(frames):
             return None
         
-        return b''.join(frames)
+        # prepare_for_upload reads the blocks directly, no contiguous copy needed
+        return frames
     
-    def transcribe_audio(self, audio_data):
-        """Convert audio to text using Whisper"""
+    def transcribe_audio(self, upload_data):
+        """Convert 16 kHz audio (see prepare_for_upload) to text using Whisper"""
         if not self.check_api_limit():
             return None
             
@@ -104,17 +140,18 @@ class SimpleVoiceDiary:
                 wav_file.setnchannels(self.CHANNELS)
                 wav_file.setsampwidth(self.audio.get_sample_size(self.FORMAT))
                 wav_file.setframerate(self.RATE)
-                wav_file.writeframes(audio_data)
+                wav_file.writeframes(upload_data.tobytes())
             
             # Transcribe
             with open(temp_path, 'rb') as audio_file:
                 response = self.client.audio.transcriptions.create(
                     model="whisper-1",
                     file=audio_file,
-                    language="en"
+                    **self.language.transcription_options()
                 )
             
             self.api_usage_count += 1
+            self.language.observe_transcription(response)
             
             # Cleanup
             try:
@@ -128,26 +165,34 @@ class SimpleVoiceDiary:
             print(f"STT Error: {str(e)}")
             return input("STT failed. Please type your message: ").strip()
     
+    def archive_audio(self, upload_data):
+        """Store the utterance in the audio archive (if enabled) and return its hash"""
+        if self.archive is None:
+            return None
+        try:
+            return self.archive.add(upload_data, self.RATE)
+        except Exception as e:
+            print(f"Archive Error: {str(e)}")
+            return None
+    
     def get_ai_response(self, user_message):
         """Get AI response using GPT-4o-mini"""
         if not self.check_api_limit():
             return None, None
             
         try:
-            response = self.client.chat.completions.create(
+            # No history in the request, so a repeated message can reuse a recent reply
+            response, reused = self.requests.chat(dict(
                 model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """You are a supportive friend helping someone with their voice diary. Be warm, empathetic, and ask thoughtful follow-up questions. Keep responses under 50 words. At the end, include emotion analysis: EMOTION_ANALYSIS: [emotion] [0.0-1.0]"""
-                    },
+                messages=self.language.system_messages(CONVERSATION_PROMPT) + [
                     {"role": "user", "content": user_message}
                 ],
                 max_tokens=100,
                 temperature=0.7
-            )
+            ), memo_ttl=DEFAULT_MEMO_TTL)
             
-            self.api_usage_count += 1
+            if not reused:
+                self.api_usage_count += 1
             ai_response = response.choices[0].message.content.strip()
             
             # Extract emotion
@@ -174,54 +219,77 @@ class SimpleVoiceDiary:
             return "No conversation to summarize."
             
         try:
-            conversation_text = ""
-            for item in self.conversation_data:
-                speaker = "I said" if item["speaker"] == "user" else "AI asked"
-                conversation_text += f"{speaker}: {item['message']}\\n"
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Create a first-person diary entry from this conversation. Write as if the user is personally writing their diary. Include emotions and key events. Use 'I' statements throughout."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Create a diary entry:\\n\\n{conversation_text}"
-                    }
-                ],
-                max_tokens=200,
-                temperature=0.7
-            )
+            response, reused = self.requests.chat(self.summary_request())
             
-            self.api_usage_count += 1
+            if not reused:
+                self.api_usage_count += 1
             return response.choices[0].message.content.strip()
             
         except Exception as e:
             return f"Could not generate diary entry: {str(e)}"
     
-    def save_conversation(self, diary_entry):
-        """Save to JSON file"""
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+    def summary_request(self):
+        """Chat completion arguments for the diary entry (used directly or batched)"""
+        if not self.language.resolved:  # e.g. finalizing a recovered session
+            self.language.observe_text(" ".join(self.conversation_data.messages("user")))
+        
+        conversation_text = self.conversation_data.transcript(SIMPLE_TRANSCRIPT)
+        
+        return dict(
+            model="gpt-4o-mini",
+            messages=self.language.system_messages(SUMMARY_PROMPT) + [
+                {
+                    "role": "user",
+                    "content": f"Create a diary entry:\\n\\n{conversation_text}"
+                }
+            ],
+            max_tokens=200,
+            temperature=0.7
+        )
+    
+    def queue_diary_entry(self):
+        """Save now with a pending entry and queue it for the next summary batch"""
+        job_id = new_job_id()
+        filename = self.save_conversation(PENDING_SUMMARY, summary_job=job_id)
+        enqueue_summary(job_id, self.summary_request(), {
+            "type": "day_file",
+            "path": os.path.abspath(filename),
+            "key": "diary_entry"
+        })
+        print("*** Your diary entry will be written by the next summary batch (python batch_summaries.py run) ***")
+    
+    def save_conversation(self, diary_entry, summary_job=None):
+        """Save to JSON file; returns the file name"""
+        today = self.session_date or datetime.datetime.now().strftime("%Y-%m-%d")
         filename = f"simple_voice_diary_{today}.json"
         
         data = {
             "date": today,
-            "conversation": self.conversation_data,
+            "conversation": list(self.conversation_data),
             "diary_entry": diary_entry,
-            "api_usage": self.api_usage_count
+            "api_usage": self.api_usage_count,
+            "language": self.language.effective
         }
+        if summary_job:
+            data["summary_job"] = summary_job
+        
+        if self.store is not None:
+            record_id = self.store.append("simple_voice_session", today, data)
+            print(f"\\n*** Saved to encrypted store (record {record_id}) ***")
+            return
         
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         
         print(f"\\n*** Saved to {filename} ***")
+        return filename
     
     def run(self):
         """Main conversation loop"""
+        self.turn_log = recover_session(self, "simple_voice_diary") or TurnLog.start("simple_voice_diary", self.store)
+        
         print("\\n*** Starting Simple Voice Diary ***")
-        print("AI: Hi! I'm here to help you reflect on your day. How are you feeling?")
+        print(f"AI: {self.localize(GREETING)}")
         
         while True:
             try:
@@ -232,10 +300,13 @@ class SimpleVoiceDiary:
                 elif choice == 'v':
                     # Voice input
                     audio_data = self.record_audio_simple()
-                    if audio_data:
-                        user_text = self.transcribe_audio(audio_data)
+                    if audio_data is not None:
+                        # Already at 16 kHz, so this only normalizes the level
+                        upload_data = prepare_for_upload(audio_data, self.RATE, self.RATE, self.NORMALIZE_AUDIO)
+                        user_text = self.transcribe_audio(upload_data)
                         if not user_text:
                             continue
+                        audio_ref = self.archive_audio(upload_data)
                     else:
                         continue
                 elif choice == 't':
@@ -243,6 +314,8 @@ class SimpleVoiceDiary:
                     user_text = input("You: ").strip()
                     if not user_text:
                         continue
+                    self.language.observe_text(user_text)
+                    audio_ref = None
                 else:
                     print("Please enter 'v', 't', or 'quit'")
                     continue
@@ -257,25 +330,38 @@ class SimpleVoiceDiary:
                 print(f"AI: {ai_response}")
                 
                 # Store conversation
-                self.conversation_data.append({
+                user_item = {
                     "speaker": "user",
                     "message": user_text,
                     "timestamp": datetime.datetime.now().isoformat(),
                     "emotion": emotion
-                })
-                
-                self.conversation_data.append({
+                }
+                if audio_ref:
+                    user_item["audio"] = audio_ref
+                ai_item = {
                     "speaker": "ai",
                     "message": ai_response,
                     "timestamp": datetime.datetime.now().isoformat()
-                })
+                }
+                self.conversation_data.append(user_item)
+                self.conversation_data.append(ai_item)
+                
+                # Write-ahead so a crash doesn't lose the session
+                self.turn_log.append_item(user_item)
+                self.turn_log.append_item(ai_item)
                 
             except KeyboardInterrupt:
                 print("\\n*** Interrupted ***")
                 break
         
         # Generate diary
-        if self.conversation_data:
+        if self.conversation_data and not self.check_api_limit():
+            self.turn_log.close()
+            print("*** Session kept. You can finalize it next time you start the app. ***")
+        elif self.conversation_data and deferred_enabled() and self.store is None:
+            self.queue_diary_entry()
+            self.turn_log.discard()
+        elif self.conversation_data:
             print("\\n*** Generating diary entry... ***")
             diary_entry = self.generate_diary_entry()
             
@@ -286,7 +372,12 @@ class SimpleVoiceDiary:
             print("="*50)
             
             self.save_conversation(diary_entry)
+            self.turn_log.discard()
             print(f"API calls used: {self.api_usage_count}")
+            for line in self.requests.report():
+                print(line)
+        else:
+            self.turn_log.discard()
         
         self.audio.terminate()
         print("\\n*** Voice Diary Complete ***")